@@ -24,20 +24,24 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x14\x61udio_analyzer.proto\x12\raudioanalyzer\"J\n\x13\x41nalyzeAudioRequest\x12\x19\n\x11minio_bucket_name\x18\x01 \x01(\t\x12\x18\n\x10minio_object_key\x18\x02 \x01(\t\"m\n\x14\x41udioChunkPrediction\x12\x10\n\x08\x63hunk_id\x18\x01 \x01(\t\x12\r\n\x05score\x18\x02 \x01(\x02\x12\x1a\n\x12start_time_seconds\x18\x03 \x01(\x02\x12\x18\n\x10\x65nd_time_seconds\x18\x04 \x01(\x02\"g\n\x14\x41nalyzeAudioResponse\x12\x38\n\x0bpredictions\x18\x01 \x03(\x0b\x32#.audioanalyzer.AudioChunkPrediction\x12\x15\n\rerror_message\x18\x02 \x01(\t2h\n\rAudioAnalysis\x12W\n\x0c\x41nalyzeAudio\x12\".audioanalyzer.AnalyzeAudioRequest\x1a#.audioanalyzer.AnalyzeAudioResponseB,Z*example.com/auth_service/gen/audioanalyzerb\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x14\x61udio_analyzer.proto\x12\raudioanalyzer\"\xa9\x01\n\x13\x41nalyzeAudioRequest\x12\x19\n\x11minio_bucket_name\x18\x01 \x01(\t\x12\x18\n\x10minio_object_key\x18\x02 \x01(\t\x12\x12\n\nmodel_name\x18\x04 \x01(\t\x12)\n\x08priority\x18\x05 \x01(\x0e\x32\x17.audioanalyzer.Priority\x12\x1e\n\x16\x61\x64\x64itional_model_names\x18\x06 \x03(\t\"/\n\nModelScore\x12\x12\n\nmodel_name\x18\x01 \x01(\t\x12\r\n\x05score\x18\x02 \x01(\x02\"\xa3\x01\n\x14\x41udioChunkPrediction\x12\x10\n\x08\x63hunk_id\x18\x01 \x01(\t\x12\r\n\x05score\x18\x02 \x01(\x02\x12\x1a\n\x12start_time_seconds\x18\x03 \x01(\x02\x12\x18\n\x10\x65nd_time_seconds\x18\x04 \x01(\x02\x12\x34\n\x11\x61\x64\x64itional_scores\x18\x05 \x03(\x0b\x32\x19.audioanalyzer.ModelScore\"{\n\x14\x41nalyzeAudioResponse\x12\x38\n\x0bpredictions\x18\x01 \x03(\x0b\x32#.audioanalyzer.AudioChunkPrediction\x12\x15\n\rerror_message\x18\x02 \x01(\t\x12\x12\n\nmodel_name\x18\x03 \x01(\t*7\n\x08Priority\x12\x18\n\x14PRIORITY_INTERACTIVE\x10\x00\x12\x11\n\rPRIORITY_BULK\x10\x01\x32h\n\rAudioAnalysis\x12W\n\x0c\x41nalyzeAudio\x12\".audioanalyzer.AnalyzeAudioRequest\x1a#.audioanalyzer.AnalyzeAudioResponseB$Z\"example.com/auth_service/gen/protob\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
 _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'audio_analyzer_pb2', _globals)
 if not _descriptor._USE_C_DESCRIPTORS:
   _globals['DESCRIPTOR']._loaded_options = None
-  _globals['DESCRIPTOR']._serialized_options = b'Z*example.com/auth_service/gen/audioanalyzer'
-  _globals['_ANALYZEAUDIOREQUEST']._serialized_start=39
-  _globals['_ANALYZEAUDIOREQUEST']._serialized_end=113
-  _globals['_AUDIOCHUNKPREDICTION']._serialized_start=115
-  _globals['_AUDIOCHUNKPREDICTION']._serialized_end=224
-  _globals['_ANALYZEAUDIORESPONSE']._serialized_start=226
-  _globals['_ANALYZEAUDIORESPONSE']._serialized_end=329
-  _globals['_AUDIOANALYSIS']._serialized_start=331
-  _globals['_AUDIOANALYSIS']._serialized_end=435
+  _globals['DESCRIPTOR']._serialized_options = b'Z\"example.com/auth_service/gen/proto'
+  _globals['_PRIORITY']._serialized_start=551
+  _globals['_PRIORITY']._serialized_end=606
+  _globals['_ANALYZEAUDIOREQUEST']._serialized_start=40
+  _globals['_ANALYZEAUDIOREQUEST']._serialized_end=209
+  _globals['_MODELSCORE']._serialized_start=211
+  _globals['_MODELSCORE']._serialized_end=258
+  _globals['_AUDIOCHUNKPREDICTION']._serialized_start=261
+  _globals['_AUDIOCHUNKPREDICTION']._serialized_end=424
+  _globals['_ANALYZEAUDIORESPONSE']._serialized_start=426
+  _globals['_ANALYZEAUDIORESPONSE']._serialized_end=549
+  _globals['_AUDIOANALYSIS']._serialized_start=608
+  _globals['_AUDIOANALYSIS']._serialized_end=712
 # @@protoc_insertion_point(module_scope)
@@ -1,34 +1,60 @@
 from google.protobuf.internal import containers as _containers
+from google.protobuf.internal import enum_type_wrapper as _enum_type_wrapper
 from google.protobuf import descriptor as _descriptor
 from google.protobuf import message as _message
 from typing import ClassVar as _ClassVar, Iterable as _Iterable, Mapping as _Mapping, Optional as _Optional, Union as _Union
 
 DESCRIPTOR: _descriptor.FileDescriptor
 
+class Priority(int, metaclass=_enum_type_wrapper.EnumTypeWrapper):
+    __slots__ = ()
+    PRIORITY_INTERACTIVE: _ClassVar[Priority]
+    PRIORITY_BULK: _ClassVar[Priority]
+PRIORITY_INTERACTIVE: Priority
+PRIORITY_BULK: Priority
+
 class AnalyzeAudioRequest(_message.Message):
-    __slots__ = ("minio_bucket_name", "minio_object_key")
+    __slots__ = ("minio_bucket_name", "minio_object_key", "model_name", "priority", "additional_model_names")
     MINIO_BUCKET_NAME_FIELD_NUMBER: _ClassVar[int]
     MINIO_OBJECT_KEY_FIELD_NUMBER: _ClassVar[int]
+    MODEL_NAME_FIELD_NUMBER: _ClassVar[int]
+    PRIORITY_FIELD_NUMBER: _ClassVar[int]
+    ADDITIONAL_MODEL_NAMES_FIELD_NUMBER: _ClassVar[int]
     minio_bucket_name: str
     minio_object_key: str
-    def __init__(self, minio_bucket_name: _Optional[str] = ..., minio_object_key: _Optional[str] = ...) -> None: ...
+    model_name: str
+    priority: Priority
+    additional_model_names: _containers.RepeatedScalarFieldContainer[str]
+    def __init__(self, minio_bucket_name: _Optional[str] = ..., minio_object_key: _Optional[str] = ..., model_name: _Optional[str] = ..., priority: _Optional[_Union[Priority, str]] = ..., additional_model_names: _Optional[_Iterable[str]] = ...) -> None: ...
+
+class ModelScore(_message.Message):
+    __slots__ = ("model_name", "score")
+    MODEL_NAME_FIELD_NUMBER: _ClassVar[int]
+    SCORE_FIELD_NUMBER: _ClassVar[int]
+    model_name: str
+    score: float
+    def __init__(self, model_name: _Optional[str] = ..., score: _Optional[float] = ...) -> None: ...
 
 class AudioChunkPrediction(_message.Message):
-    __slots__ = ("chunk_id", "score", "start_time_seconds", "end_time_seconds")
+    __slots__ = ("chunk_id", "score", "start_time_seconds", "end_time_seconds", "additional_scores")
     CHUNK_ID_FIELD_NUMBER: _ClassVar[int]
     SCORE_FIELD_NUMBER: _ClassVar[int]
     START_TIME_SECONDS_FIELD_NUMBER: _ClassVar[int]
     END_TIME_SECONDS_FIELD_NUMBER: _ClassVar[int]
+    ADDITIONAL_SCORES_FIELD_NUMBER: _ClassVar[int]
     chunk_id: str
     score: float
     start_time_seconds: float
     end_time_seconds: float
-    def __init__(self, chunk_id: _Optional[str] = ..., score: _Optional[float] = ..., start_time_seconds: _Optional[float] = ..., end_time_seconds: _Optional[float] = ...) -> None: ...
+    additional_scores: _containers.RepeatedCompositeFieldContainer[ModelScore]
+    def __init__(self, chunk_id: _Optional[str] = ..., score: _Optional[float] = ..., start_time_seconds: _Optional[float] = ..., end_time_seconds: _Optional[float] = ..., additional_scores: _Optional[_Iterable[_Union[ModelScore, _Mapping]]] = ...) -> None: ...
 
 class AnalyzeAudioResponse(_message.Message):
-    __slots__ = ("predictions", "error_message")
+    __slots__ = ("predictions", "error_message", "model_name")
     PREDICTIONS_FIELD_NUMBER: _ClassVar[int]
     ERROR_MESSAGE_FIELD_NUMBER: _ClassVar[int]
+    MODEL_NAME_FIELD_NUMBER: _ClassVar[int]
     predictions: _containers.RepeatedCompositeFieldContainer[AudioChunkPrediction]
     error_message: str
-    def __init__(self, predictions: _Optional[_Iterable[_Union[AudioChunkPrediction, _Mapping]]] = ..., error_message: _Optional[str] = ...) -> None: ...
+    model_name: str
+    def __init__(self, predictions: _Optional[_Iterable[_Union[AudioChunkPrediction, _Mapping]]] = ..., error_message: _Optional[str] = ..., model_name: _Optional[str] = ...) -> None: ...
@@ -0,0 +1,56 @@
+import os
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Сколько декодированного аудио (float32) может одновременно находиться в памяти всех запросов
+MAX_INFLIGHT_DECODED_MB = int(os.getenv('MAX_INFLIGHT_DECODED_MB', '1024'))
+# Оценка для файлов без длительности в заголовке (webm/opus из MediaRecorder): во сколько раз
+# декодированный float32 больше сжатого файла. Резерв по такой оценке не превышает четверти бюджета
+UNKNOWN_DURATION_EXPANSION_RATIO = int(os.getenv('UNKNOWN_DURATION_EXPANSION_RATIO', '32'))
+
+
+class DecodedAudioBudget:
+    """
+    Ограничивает суммарный объем декодированного аудио, который держат запросы.
+    reserve() блокируется, пока не освободится место. Файл крупнее всего бюджета
+    допускается, но только когда в работе нет других файлов.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._used = 0
+        self._condition = threading.Condition()
+
+    def reserve(self, nbytes: int) -> int:
+        """Резервирует nbytes и возвращает фактически зарезервированный объем (для release)."""
+        nbytes = min(max(nbytes, 0), self.max_bytes) if self.max_bytes > 0 else 0
+        with self._condition:
+            while self._used > 0 and self._used + nbytes > self.max_bytes:
+                logger.info(f"Ожидание бюджета декодированного аудио: занято {self._used} из {self.max_bytes} байт, нужно {nbytes}")
+                self._condition.wait()
+            self._used += nbytes
+        return nbytes
+
+    def resize(self, reserved: int, nbytes: int) -> int:
+        """
+        Заменяет резерв reserved фактическим объемом nbytes (после декодирования) без ожидания:
+        память уже выделена. Возвращает новый резерв (для release).
+        """
+        nbytes = min(max(nbytes, 0), self.max_bytes) if self.max_bytes > 0 else 0
+        with self._condition:
+            self._used += nbytes - reserved
+            if nbytes < reserved:
+                self._condition.notify_all()
+        return nbytes
+
+    def release(self, nbytes: int):
+        if nbytes <= 0:
+            return
+        with self._condition:
+            self._used -= nbytes
+            self._condition.notify_all()
+
+
+DECODED_AUDIO_BUDGET = DecodedAudioBudget(MAX_INFLIGHT_DECODED_MB * 1024 * 1024)
@@ -0,0 +1,125 @@
+"""
+Подбор числа потоков инференса для текущего хоста: перебирает INFERENCE_WORKERS x TORCH_INTRA_OP_THREADS
+(и, опционально, закрепление потоков за ядрами) на синтетической нагрузке и печатает лучшую конфигурацию.
+Каждый вариант запускается в отдельном процессе (OMP_NUM_THREADS/MKL_NUM_THREADS задаются до импорта torch),
+чтобы OMP/MKL и пулы torch инициализировались с нуля.
+
+Запуск из директории server/:
+    python autotune_threads.py --duration 20 --try-pinning
+    python autotune_threads.py --numa-node 0
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import torch
+
+from runtime_config import available_cpus, numa_node_cpus, apply_runtime_config, create_inference_executor, RuntimeConfig
+from inference import (
+    load_model_from_checkpoint,
+    apply_precision,
+    predict_logits,
+    resolve_precision,
+    CHECKPOINT_FILE,
+    INFERENCE_BATCH_SIZE,
+    INFERENCE_PRECISION,
+    NUM_SAMPLES,
+)
+
+
+def run_candidate(args):
+    """Дочерний процесс: применяет конфигурацию из окружения и гоняет батчи через общий пул инференса."""
+    config = RuntimeConfig.from_env()
+    apply_runtime_config(config)
+    device = torch.device("cpu")
+    model = load_model_from_checkpoint(args.checkpoint, device)
+    if model is None:
+        raise SystemExit("Не удалось загрузить модель.")
+    model.eval()
+    precision = resolve_precision(INFERENCE_PRECISION, device)
+    apply_precision(model, precision)
+
+    batch = torch.randn(args.batch_size, NUM_SAMPLES, generator=torch.Generator().manual_seed(0)) * 0.1
+
+    def timed_batch():
+        started = time.perf_counter()
+        predict_logits(model, batch, precision)
+        return time.perf_counter() - started
+
+    with create_inference_executor(config) as executor:
+        list(executor.map(lambda _: timed_batch(), range(config.inference_workers))) # Прогрев каждого потока
+        latencies = []
+        started = time.perf_counter()
+        while time.perf_counter() - started < args.duration:
+            # Держим занятыми все потоки пула, как при нескольких параллельных запросах
+            latencies.extend(executor.map(lambda _: timed_batch(), range(config.inference_workers * 2)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(json.dumps({
+        "chunks_per_second": len(latencies) * args.batch_size / elapsed,
+        "p95_batch_ms": latencies[int(0.95 * (len(latencies) - 1))] * 1000,
+    }))
+
+
+def candidate_configs(cpus, try_pinning: bool):
+    """Варианты, у которых workers x intra_op не превышает числа ядер, плюс прежняя схема (все ядра на каждый forward)."""
+    num_cpus = len(cpus)
+    candidates = [RuntimeConfig(min(8, num_cpus), num_cpus, 1, cpus)] # Без настройки: intra-op пул на все ядра в каждом потоке
+    workers = 1
+    while workers <= num_cpus:
+        candidates.append(RuntimeConfig(workers, num_cpus // workers, 1, cpus))
+        if try_pinning and workers > 1:
+            candidates.append(RuntimeConfig(workers, num_cpus // workers, 1, cpus, pin_workers=True))
+        workers *= 2
+    return candidates
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--checkpoint', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), CHECKPOINT_FILE))
+    parser.add_argument('--batch-size', type=int, default=INFERENCE_BATCH_SIZE)
+    parser.add_argument('--duration', type=float, default=15.0, help="Секунд нагрузки на каждый вариант")
+    parser.add_argument('--numa-node', type=int, default=None, help="Ограничить перебор ядрами NUMA-узла")
+    parser.add_argument('--try-pinning', action='store_true', help="Дополнительно проверить закрепление потоков за ядрами")
+    parser.add_argument('--run-candidate', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_candidate:
+        run_candidate(args)
+        return
+
+    cpus = numa_node_cpus(args.numa_node) if args.numa_node is not None else available_cpus()
+    print(f"Доступно ядер: {len(cpus)}, batch_size={args.batch_size}, {args.duration:.0f} с на вариант")
+    print(f"{'workers':>7} {'intra':>5} {'pin':>5} {'chunks/s':>9} {'p95 ms':>8}")
+    results = []
+    for config in candidate_configs(cpus, args.try_pinning):
+        env = dict(os.environ, **config.as_env(), OMP_NUM_THREADS=str(config.intra_op_threads), MKL_NUM_THREADS=str(config.intra_op_threads))
+        env.pop('INFERENCE_NUMA_NODE', None) # Ядра уже переданы через INFERENCE_CPU_AFFINITY
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--run-candidate', '--checkpoint', args.checkpoint,
+             '--batch-size', str(args.batch_size), '--duration', str(args.duration)],
+            env=env, capture_output=True, text=True)
+        if completed.returncode != 0:
+            print(f"{config.inference_workers:>7} {config.intra_op_threads:>5} {str(config.pin_workers):>5} ошибка: {completed.stderr.strip().splitlines()[-1:]}")
+            continue
+        metrics = json.loads(completed.stdout.strip().splitlines()[-1])
+        results.append((metrics, config))
+        print(f"{config.inference_workers:>7} {config.intra_op_threads:>5} {str(config.pin_workers):>5} "
+              f"{metrics['chunks_per_second']:>9.2f} {metrics['p95_batch_ms']:>8.1f}")
+
+    if not results:
+        raise SystemExit("Ни один вариант не отработал.")
+    best_metrics, best_config = max(results, key=lambda item: item[0]['chunks_per_second'])
+    print(f"\nЛучшая конфигурация ({best_metrics['chunks_per_second']:.2f} чанков/с):")
+    for name, value in best_config.as_env().items():
+        print(f"export {name}={value}")
+    print(f"export OMP_NUM_THREADS={best_config.intra_op_threads}")
+    print(f"export MKL_NUM_THREADS={best_config.intra_op_threads}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Сравнение точностей инференса (fp32 / bf16_autocast / bf16): разница score относительно fp32,
+задержка на чанк, объем весов модели и пиковая RSS на инференсе. Каждая точность считается
+в отдельном процессе: пик RSS процесса не уменьшается, и прогон одной точности исказил бы пик следующей.
+
+Запуск из директории server/:
+    python bench_precision.py --batch-size 4 --iterations 10 --audio ../audiotests/eng.mp3
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import time
+import logging
+from concurrent import futures
+
+import torch
+
+from inference import (
+    load_model_from_checkpoint,
+    apply_precision,
+    cpu_supports_bf16,
+    decode_audio_bytes,
+    predict_logits,
+    to_chunk_buffer,
+    resolve_precision,
+    CHECKPOINT_FILE,
+    NUM_SAMPLES,
+    PRECISIONS,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def load_chunks(audio_paths, num_random: int) -> torch.Tensor:
+    """Чанки [N, NUM_SAMPLES] из указанных файлов плюс num_random чанков шума."""
+    chunks = []
+    for path in audio_paths:
+        with open(path, 'rb') as f:
+            signal, sr, errors = decode_audio_bytes(f.read())
+        if signal is None:
+            logger.warning(f"Пропускаем {path}: {errors}")
+            continue
+        chunk_buffer, total_samples = to_chunk_buffer(signal, sr)
+        chunks.extend(chunk_buffer[:total_samples // NUM_SAMPLES]) # Только полные чанки, без паддинга
+    generator = torch.Generator().manual_seed(0)
+    chunks.extend(torch.randn(num_random, NUM_SAMPLES, generator=generator) * 0.1)
+    return torch.stack(chunks)
+
+
+def weights_megabytes(model: torch.nn.Module) -> float:
+    return sum(p.numel() * p.element_size() for p in model.parameters()) / 2**20
+
+
+def reset_peak_rss() -> bool:
+    """Сбрасывает пик RSS процесса (VmHWM) до текущей RSS; Linux 4.0+. False - сброс недоступен."""
+    try:
+        with open("/proc/self/clear_refs", 'w') as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_megabytes() -> float:
+    """Пик RSS процесса (VmHWM, с учетом reset_peak_rss); без /proc - ru_maxrss за все время процесса."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # Linux: КБ
+
+
+def run_precision(model, chunks: torch.Tensor, precision: str, batch_size: int, iterations: int):
+    """Возвращает (scores [N], секунд на чанк)."""
+    # Прогрев, чтобы не мерить выбор ядер и рост аллокатора
+    predict_logits(model, chunks[:batch_size], precision)
+    started = time.perf_counter()
+    for _ in range(iterations):
+        scores = torch.cat([
+            torch.sigmoid(predict_logits(model, chunks[i:i + batch_size], precision))
+            for i in range(0, chunks.shape[0], batch_size)
+        ])
+    elapsed = time.perf_counter() - started
+    return scores.float().cpu(), elapsed / (iterations * chunks.shape[0])
+
+
+def measure_precision(checkpoint: str, chunks: torch.Tensor, precision: str, batch_size: int, iterations: int):
+    """
+    Выполняется в отдельном процессе. Возвращает (scores [N], секунд на чанк, МБ весов, пик RSS в МБ).
+    Пик считается от момента после загрузки модели: в него входят веса этой точности и рабочая память инференса,
+    но не временные копии загрузки чекпоинта (если сброс пика недоступен - входят).
+    """
+    model = load_model_from_checkpoint(checkpoint, torch.device("cpu"))
+    if model is None:
+        raise RuntimeError(f"Не удалось загрузить модель из {checkpoint}")
+    apply_precision(model, precision)
+    if not reset_peak_rss():
+        logger.warning("Сброс пика RSS недоступен: пик включает загрузку чекпоинта.")
+    scores, latency = run_precision(model, chunks, precision, batch_size, iterations)
+    return scores, latency, weights_megabytes(model), peak_rss_megabytes()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--checkpoint', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), CHECKPOINT_FILE))
+    parser.add_argument('--audio', nargs='*', default=[], help="Аудиофайлы для сравнения на реальных данных")
+    parser.add_argument('--random-chunks', type=int, default=8, help="Сколько чанков шума добавить")
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--iterations', type=int, default=5)
+    args = parser.parse_args()
+
+    device = torch.device("cpu")
+    logger.info(f"Нативная поддержка bf16 на CPU: {cpu_supports_bf16()}")
+    chunks = load_chunks(args.audio, args.random_chunks)
+    logger.info(f"Чанков для сравнения: {chunks.shape[0]}, batch_size={args.batch_size}")
+
+    reference_scores = None
+    reference_latency = None
+    print(f"{'precision':<14} {'ms/chunk':>9} {'speedup':>8} {'weights MB':>11} {'peak RSS MB':>12} {'max |d|':>9} {'mean |d|':>9}")
+    for requested in PRECISIONS:
+        precision = resolve_precision(requested, device)
+        if precision != requested:
+            print(f"{requested:<14} пропущено: не поддерживается на этом CPU")
+            continue
+        # Новый процесс на каждую точность: пик RSS процесса только растет
+        with futures.ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            try:
+                scores, latency, weights_mb, peak_rss_mb = executor.submit(
+                    measure_precision, args.checkpoint, chunks, precision, args.batch_size, args.iterations).result()
+            except RuntimeError as e:
+                raise SystemExit(str(e))
+        if reference_scores is None:
+            reference_scores, reference_latency = scores, latency
+        delta = (scores - reference_scores).abs()
+        print(f"{precision:<14} {latency * 1000:>9.2f} {reference_latency / latency:>8.2f} "
+              f"{weights_mb:>11.1f} {peak_rss_mb:>12.1f} {delta.max().item():>9.5f} {delta.mean().item():>9.5f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Сравнение пикового потребления памяти предобработкой: старый путь (Resample -> mean -> squeeze ->
+.numpy()/np.pad/tobytes/frombuffer/from_numpy на каждый чанк через Redis), буфер чанков с Redis-стейджингом
+(pipeline SET окна, MGET + np.stack на батч) и буфер чанков со срезами (путь по умолчанию).
+Все варианты держат вход модели только на время обработки одного батча (чанка), окнами как сервер.
+Каждый вариант запускается в отдельном процессе, пик считается по ru_maxrss относительно RSS после декодирования.
+
+Запуск из директории server/:
+    python bench_preprocess.py --minutes 1 5 15 --sample-rate 44100 --channels 2
+"""
+import argparse
+import multiprocessing
+import resource
+import sys
+import time
+
+import numpy as np
+import torch
+import torchaudio
+
+from inference import to_chunk_buffer, iter_chunk_batches, INFERENCE_BATCH_SIZE, SAMPLE_RATE, NUM_SAMPLES
+from chunk_store import CHECKPOINT_WINDOW_CHUNKS
+
+
+def current_rss_kb() -> int:
+    """Текущий RSS процесса в КБ (Linux /proc); без /proc - пиковый ru_maxrss."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize() // 1024
+    except OSError:
+        return peak_rss_kb()
+
+
+def peak_rss_kb() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak # На macOS ru_maxrss в байтах
+
+
+def consume(batch: torch.Tensor):
+    """Заменяет forward модели: вход нужен только на время обработки и сразу освобождается."""
+    float(batch[0, 0])
+
+
+def legacy_pipeline(signal: torch.Tensor, sr: int, batch_size: int, window_chunks: int) -> int:
+    """
+    Предобработка в том виде, в котором она была до буфера чанков: срезы сигнала, SET каждого чанка
+    в Redis отдельно, GET + frombuffer + from_numpy на каждый чанк (батчей не было). Redis вне процесса,
+    поэтому отправленные байты сразу освобождаются, а полученные живут до конца обработки чанка.
+    """
+    if sr != SAMPLE_RATE:
+        signal = torchaudio.transforms.Resample(orig_freq=sr, new_freq=SAMPLE_RATE)(signal)
+    if signal.shape[0] > 1:
+        signal = torch.mean(signal, dim=0, keepdim=True)
+    signal = signal.squeeze(0)
+    num_chunks = -(-signal.shape[0] // NUM_SAMPLES)
+
+    def chunk_np(i: int) -> np.ndarray:
+        chunk = signal[i * NUM_SAMPLES:(i + 1) * NUM_SAMPLES].numpy()
+        if len(chunk) < NUM_SAMPLES:
+            chunk = np.pad(chunk, (0, NUM_SAMPLES - len(chunk)), 'constant')
+        return chunk
+
+    for window_start in range(0, num_chunks, window_chunks):
+        window = range(window_start, min(window_start + window_chunks, num_chunks))
+        for i in window:
+            chunk_np(i).astype(np.float32).tobytes() # SET: копия отправляется и освобождается
+        for i in window:
+            payload = chunk_np(i).astype(np.float32).tobytes() # Ответ GET
+            consume(torch.from_numpy(np.frombuffer(payload, dtype=np.float32)).unsqueeze(0))
+    return num_chunks
+
+
+def staging_pipeline(signal: torch.Tensor, sr: int, batch_size: int, window_chunks: int) -> int:
+    """
+    Буфер чанков с Redis-стейджингом (REDIS_STAGING_ENABLED=true): окно уходит одним pipeline SET
+    (все байты окна в памяти до execute), батч читается MGET и собирается np.stack.
+    """
+    chunk_buffer, _ = to_chunk_buffer(signal, sr)
+    num_chunks = chunk_buffer.shape[0]
+    for window_start in range(0, num_chunks, window_chunks):
+        window = list(range(window_start, min(window_start + window_chunks, num_chunks)))
+        pipeline_payloads = [chunk_buffer[i].numpy().tobytes() for i in window]
+        del pipeline_payloads # pipe.execute() отправил окно
+        for batch_start in range(0, len(window), batch_size):
+            payloads = [chunk_buffer[i].numpy().tobytes() for i in window[batch_start:batch_start + batch_size]] # Ответ MGET
+            consume(torch.from_numpy(np.stack([np.frombuffer(payload, dtype=np.float32) for payload in payloads])))
+            del payloads
+    return num_chunks
+
+
+def buffer_pipeline(signal: torch.Tensor, sr: int, batch_size: int, window_chunks: int) -> int:
+    """Путь по умолчанию: один буфер [num_chunks, NUM_SAMPLES] и батчи-срезы из него без копирования."""
+    chunk_buffer, _ = to_chunk_buffer(signal, sr)
+    num_chunks = chunk_buffer.shape[0]
+    for window_start in range(0, num_chunks, window_chunks):
+        window = list(range(window_start, min(window_start + window_chunks, num_chunks)))
+        for _, batch in iter_chunk_batches(chunk_buffer, window, batch_size):
+            consume(batch)
+    return num_chunks
+
+
+PIPELINES = {"legacy": legacy_pipeline, "staging": staging_pipeline, "buffer": buffer_pipeline}
+
+
+def measure(pipeline_name: str, minutes: float, sample_rate: int, channels: int, batch_size: int, window_chunks: int, queue):
+    """Выполняется в дочернем процессе, чтобы пики вариантов не смешивались."""
+    torch.set_num_threads(1)
+    signal = torch.randn(channels, int(minutes * 60 * sample_rate)) * 0.1
+    baseline_kb = max(current_rss_kb(), peak_rss_kb())
+    started = time.perf_counter()
+    num_chunks = PIPELINES[pipeline_name](signal, sample_rate, batch_size, window_chunks)
+    elapsed = time.perf_counter() - started
+    queue.put((peak_rss_kb() - baseline_kb, elapsed, num_chunks))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--minutes', type=float, nargs='+', default=[1.0, 5.0])
+    parser.add_argument('--sample-rate', type=int, default=44100, help="Частота исходного (декодированного) сигнала")
+    parser.add_argument('--channels', type=int, default=2)
+    parser.add_argument('--batch-size', type=int, default=INFERENCE_BATCH_SIZE)
+    parser.add_argument('--window-chunks', type=int, default=CHECKPOINT_WINDOW_CHUNKS)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    print(f"{'pipeline':<8} {'minutes':>8} {'chunks':>7} {'peak MB':>9} {'MB/min':>8} {'seconds':>8}")
+    for minutes in args.minutes:
+        for pipeline_name in PIPELINES:
+            queue = context.Queue()
+            process = context.Process(target=measure, args=(pipeline_name, minutes, args.sample_rate, args.channels, args.batch_size, args.window_chunks, queue))
+            process.start()
+            peak_kb, elapsed, num_chunks = queue.get()
+            process.join()
+            peak_mb = peak_kb / 1024
+            print(f"{pipeline_name:<8} {minutes:>8.1f} {num_chunks:>7} {peak_mb:>9.1f} {peak_mb / minutes:>8.1f} {elapsed:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
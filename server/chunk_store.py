@@ -0,0 +1,160 @@
+import os
+import threading
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import redis
+import redis.asyncio as aioredis
+
+logger = logging.getLogger(__name__)
+
+# Настройки чекпоинтов посчитанных чанков
+CHECKPOINT_ENABLED = os.getenv('CHECKPOINT_ENABLED', 'True').lower() == 'true'
+CHECKPOINT_EXPIRY_SECONDS = int(os.getenv('CHECKPOINT_EXPIRY_SECONDS', str(24 * 3600))) # 1 сутки
+CHECKPOINT_WINDOW_CHUNKS = int(os.getenv('CHECKPOINT_WINDOW_CHUNKS', '64')) # Сколько чанков обрабатывается (и держится в Redis) за раз
+LOCAL_CHECKPOINT_MAX_JOBS = int(os.getenv('LOCAL_CHECKPOINT_MAX_JOBS', '256')) # Лимит файлов в локальном хранилище
+
+
+def build_job_key(model_name: str, bucket_name: str, object_key: str, etag: Optional[str]) -> Optional[str]:
+    """
+    Ключ прогресса анализа: модель + объект + ETag (содержимое файла).
+    Без ETag нельзя гарантировать, что файл не менялся, поэтому чекпоинт не ведется.
+    """
+    if not CHECKPOINT_ENABLED or not etag:
+        return None
+    etag = etag.strip('"')
+    return f"scores:{model_name}:{bucket_name}/{object_key}:{etag}"
+
+
+class LocalChunkScoreStore:
+    """Хранилище score чанков в памяти процесса (замена Redis). Старые файлы вытесняются по LRU."""
+
+    def __init__(self, max_jobs: int = LOCAL_CHECKPOINT_MAX_JOBS):
+        self.max_jobs = max_jobs
+        self._jobs: "OrderedDict[str, Dict[int, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, job_key: str) -> Dict[int, float]:
+        with self._lock:
+            scores = self._jobs.get(job_key)
+            if scores is None:
+                return {}
+            self._jobs.move_to_end(job_key)
+            return dict(scores)
+
+    def save(self, job_key: str, chunk_idx: int, score: float):
+        self.save_many(job_key, {chunk_idx: score})
+
+    def save_many(self, job_key: str, scores: Dict[int, float]):
+        if not scores:
+            return
+        with self._lock:
+            self._jobs.setdefault(job_key, {}).update(scores)
+            self._jobs.move_to_end(job_key)
+            while len(self._jobs) > self.max_jobs:
+                self._jobs.popitem(last=False)
+
+
+class RedisChunkScoreStore:
+    """Хранилище score чанков в Redis: один hash на файл, поле = номер чанка."""
+
+    def __init__(self, redis_client: redis.Redis, expiry_seconds: int = CHECKPOINT_EXPIRY_SECONDS):
+        self.redis_client = redis_client
+        self.expiry_seconds = expiry_seconds
+
+    def load(self, job_key: str) -> Dict[int, float]:
+        try:
+            raw = self.redis_client.hgetall(job_key)
+        except redis.exceptions.RedisError as e:
+            logger.warning(f"Не удалось прочитать чекпоинт {job_key}: {e}")
+            return {}
+        return {int(chunk_idx): float(score) for chunk_idx, score in raw.items()}
+
+    def save(self, job_key: str, chunk_idx: int, score: float):
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.hset(job_key, chunk_idx, score)
+            pipe.expire(job_key, self.expiry_seconds)
+            pipe.execute()
+        except redis.exceptions.RedisError as e:
+            # Потеря чекпоинта не ломает запрос, лишь делает повтор дороже
+            logger.warning(f"Не удалось сохранить чекпоинт чанка {chunk_idx} для {job_key}: {e}")
+
+    def save_many(self, job_key: str, scores: Dict[int, float]):
+        """Score нескольких чанков (батча) одним pipeline: один HSET с несколькими полями и EXPIRE."""
+        if not scores:
+            return
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.hset(job_key, mapping=scores)
+            pipe.expire(job_key, self.expiry_seconds)
+            pipe.execute()
+        except redis.exceptions.RedisError as e:
+            logger.warning(f"Не удалось сохранить чекпоинт чанков {sorted(scores)} для {job_key}: {e}")
+
+
+class AsyncLocalChunkScoreStore(LocalChunkScoreStore):
+    """Асинхронный интерфейс к LocalChunkScoreStore для grpc.aio сервиса."""
+
+    async def load(self, job_key: str) -> Dict[int, float]:
+        return super().load(job_key)
+
+    async def save(self, job_key: str, chunk_idx: int, score: float):
+        super().save(job_key, chunk_idx, score)
+
+    async def save_many(self, job_key: str, scores: Dict[int, float]):
+        super().save_many(job_key, scores)
+
+
+class AsyncRedisChunkScoreStore:
+    """Асинхронный вариант RedisChunkScoreStore на redis.asyncio."""
+
+    def __init__(self, redis_client: aioredis.Redis, expiry_seconds: int = CHECKPOINT_EXPIRY_SECONDS):
+        self.redis_client = redis_client
+        self.expiry_seconds = expiry_seconds
+
+    async def load(self, job_key: str) -> Dict[int, float]:
+        try:
+            raw = await self.redis_client.hgetall(job_key)
+        except aioredis.RedisError as e:
+            logger.warning(f"Не удалось прочитать чекпоинт {job_key}: {e}")
+            return {}
+        return {int(chunk_idx): float(score) for chunk_idx, score in raw.items()}
+
+    async def save(self, job_key: str, chunk_idx: int, score: float):
+        try:
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                pipe.hset(job_key, chunk_idx, score)
+                pipe.expire(job_key, self.expiry_seconds)
+                await pipe.execute()
+        except aioredis.RedisError as e:
+            logger.warning(f"Не удалось сохранить чекпоинт чанка {chunk_idx} для {job_key}: {e}")
+
+    async def save_many(self, job_key: str, scores: Dict[int, float]):
+        """Score нескольких чанков (батча) одним pipeline: один HSET с несколькими полями и EXPIRE."""
+        if not scores:
+            return
+        try:
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                pipe.hset(job_key, mapping=scores)
+                pipe.expire(job_key, self.expiry_seconds)
+                await pipe.execute()
+        except aioredis.RedisError as e:
+            logger.warning(f"Не удалось сохранить чекпоинт чанков {sorted(scores)} для {job_key}: {e}")
+
+
+def create_chunk_score_store(redis_client: Optional[redis.Redis]):
+    """Redis, если клиент доступен, иначе локальное хранилище."""
+    if redis_client is not None:
+        return RedisChunkScoreStore(redis_client)
+    logger.info("Redis недоступен: чекпоинты чанков хранятся локально в памяти процесса.")
+    return LocalChunkScoreStore()
+
+
+def create_async_chunk_score_store(redis_client: Optional[aioredis.Redis]):
+    """Асинхронный аналог create_chunk_score_store."""
+    if redis_client is not None:
+        return AsyncRedisChunkScoreStore(redis_client)
+    logger.info("Redis недоступен: чекпоинты чанков хранятся локально в памяти процесса.")
+    return AsyncLocalChunkScoreStore()
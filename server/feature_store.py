@@ -0,0 +1,210 @@
+import os
+import glob
+import json
+import queue
+import time
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+# Хранилище признаков энкодера (выход self.pool, [hidden_size, 128] на чанк) для пересчета score новыми головами.
+# Пусто - хранилище отключено
+FEATURE_STORE_DIR = os.getenv('FEATURE_STORE_DIR', '')
+FEATURE_SHARD_ROWS = int(os.getenv('FEATURE_SHARD_ROWS', '2048')) # Максимум чанков в одном файле-шарде (~190 КБ на чанк в fp16)
+FEATURE_STORE_QUEUE_SIZE = int(os.getenv('FEATURE_STORE_QUEUE_SIZE', '256')) # Батчей в очереди записи; при переполнении отбрасываются
+FEATURE_DEDUP_KEYS = int(os.getenv('FEATURE_DEDUP_KEYS', '100000')) # Недавних ключей чанков, которые не пишутся повторно (LRU)
+
+MANIFEST_FILE = "manifest.jsonl"
+SHAPE_FILE = "shape.json" # Форма строки [H, P] пространства: в файлах шардов только сырые fp16
+FEATURE_DTYPE = np.float16
+
+
+def chunk_content_key(chunk: torch.Tensor) -> str:
+    """Ключ чанка - SHA-1 его семплов (float32, SAMPLE_RATE): одинаковое аудио в разных файлах дает один ключ."""
+    return hashlib.sha1(chunk.detach().cpu().contiguous().numpy()).hexdigest()
+
+
+def feature_space_name(backbone_key: str, precision: str) -> str:
+    """Признаки зависят от весов энкодера и точности, поэтому для каждой пары - свой каталог шардов."""
+    return f"{backbone_key[:16]}-{precision}"
+
+
+def read_row_shape(space_dir: str) -> Optional[Tuple[int, ...]]:
+    """Форма строки признаков пространства или None, если в него еще ничего не писали."""
+    try:
+        with open(os.path.join(space_dir, SHAPE_FILE), encoding='utf-8') as f:
+            return tuple(json.load(f)["shape"])
+    except FileNotFoundError:
+        return None
+
+
+class FeatureShardWriter:
+    """
+    Дописывает признаки одного пространства в шарды: shard-*.f16 (строки fp16 [H, P] подряд, только дозапись)
+    и shard-*.keys (ключ чанка на строку). Файл растет по мере записи, заранее место не выделяется.
+    Строка шарда считается записанной, только когда ее ключ попал в .keys, поэтому недописанный шард
+    после сбоя читается корректно. Повторы отсекаются по LRU недавних ключей (FEATURE_DEDUP_KEYS), а не по
+    всем ключам на диске: редкий дубль старого чанка дешевле, чем чтение всех шардов при старте.
+    """
+
+    def __init__(self, space_dir: str, shard_rows: int = FEATURE_SHARD_ROWS, dedup_keys: int = FEATURE_DEDUP_KEYS):
+        self.space_dir = space_dir
+        self.shard_rows = shard_rows
+        self.dedup_keys = dedup_keys
+        os.makedirs(space_dir, exist_ok=True)
+        self.row_shape = read_row_shape(space_dir)
+        self._recent_keys: "OrderedDict[str, None]" = OrderedDict()
+        self._data_file = None
+        self._keys_file = None
+        self._rows = 0
+        self._shard_seq = 0
+        self._pending_keys: List[str] = []
+
+    def _check_row_shape(self, row_shape: Tuple[int, ...]):
+        if self.row_shape is None:
+            tmp_path = os.path.join(self.space_dir, SHAPE_FILE + ".tmp")
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"shape": list(row_shape), "dtype": np.dtype(FEATURE_DTYPE).name}, f)
+            os.replace(tmp_path, os.path.join(self.space_dir, SHAPE_FILE))
+            self.row_shape = row_shape
+        elif row_shape != self.row_shape:
+            raise ValueError(f"Форма признаков {row_shape} не совпадает с формой пространства {self.row_shape} ({self.space_dir})")
+
+    def _open_shard(self):
+        self.close()
+        base = os.path.join(self.space_dir, f"shard-{os.getpid()}-{int(time.time())}-{self._shard_seq:04d}")
+        self._shard_seq += 1
+        self._data_file = open(base + ".f16", 'ab')
+        self._keys_file = open(base + ".keys", 'a', encoding='utf-8')
+        self._rows = 0
+
+    def _is_recent(self, key: str) -> bool:
+        if key in self._recent_keys:
+            self._recent_keys.move_to_end(key)
+            return True
+        self._recent_keys[key] = None
+        if len(self._recent_keys) > self.dedup_keys:
+            self._recent_keys.popitem(last=False)
+        return False
+
+    def write(self, keys: List[str], features: np.ndarray):
+        """features: [B, H, P] fp16. Недавно сохраненные ключи пропускаются."""
+        self._check_row_shape(tuple(features.shape[1:]))
+        for key, row in zip(keys, features):
+            if self._is_recent(key):
+                continue
+            if self._data_file is None or self._rows == self.shard_rows:
+                self._open_shard() # Заодно фиксирует строки заполненного шарда
+            self._data_file.write(np.ascontiguousarray(row, dtype=FEATURE_DTYPE).tobytes())
+            self._rows += 1
+            self._pending_keys.append(key)
+        self._commit()
+
+    def _commit(self):
+        """Сначала данные на диск, потом ключи: ключ в .keys гарантирует записанную строку."""
+        if not self._pending_keys:
+            return
+        self._data_file.flush()
+        os.fsync(self._data_file.fileno())
+        self._keys_file.write("".join(key + "\n" for key in self._pending_keys))
+        self._keys_file.flush()
+        self._pending_keys = []
+
+    def close(self):
+        self._commit()
+        if self._data_file is not None:
+            self._data_file.close()
+            self._data_file = None
+        if self._keys_file is not None:
+            self._keys_file.close()
+            self._keys_file = None
+
+
+class FeatureStore:
+    """
+    Асинхронная запись признаков энкодера в шарды. Вызовы submit/log_* не блокируются: батчи уходят
+    в ограниченную очередь и пишутся фоновым потоком; при переполнении отбрасываются.
+    """
+
+    def __init__(self, root_dir: str = FEATURE_STORE_DIR, max_queue_size: int = FEATURE_STORE_QUEUE_SIZE):
+        self.root_dir = root_dir
+        self.dropped = 0
+        self._writers = {}
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue(maxsize=max_queue_size)
+        os.makedirs(root_dir, exist_ok=True)
+        self._manifest = open(os.path.join(root_dir, MANIFEST_FILE), 'a', encoding='utf-8')
+        self._thread = threading.Thread(target=self._write_loop, name='feature-store-writer', daemon=True)
+        self._thread.start()
+
+    def _put(self, item: tuple):
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped % 100 == 1:
+                logger.warning(f"Очередь записи признаков переполнена, отброшено батчей: {self.dropped}")
+
+    def submit(self, space: str, request_id: str, chunk_indices: List[int], keys: List[str], pooled: torch.Tensor):
+        """pooled: [B, H, P]. Приведение к fp16 на CPU - единственная работа в потоке запроса."""
+        self._put(("features", space, request_id, chunk_indices, keys, pooled.detach().half().cpu().numpy()))
+
+    def log_request(self, request_id: str, bucket_name: str, object_key: str, etag: Optional[str]):
+        """Связывает request_id с объектом: по манифесту score по ключам чанков сводятся обратно к файлам."""
+        self._put(("request", {"type": "request", "ts": time.time(), "request_id": request_id,
+                               "bucket": bucket_name, "key": object_key, "etag": etag}))
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            try:
+                if item[0] == "request":
+                    self._manifest.write(json.dumps(item[1], ensure_ascii=False) + "\n")
+                else:
+                    _, space, request_id, chunk_indices, keys, features = item
+                    writer = self._writers.get(space)
+                    if writer is None:
+                        writer = self._writers[space] = FeatureShardWriter(os.path.join(self.root_dir, space))
+                    writer.write(keys, features)
+                    self._manifest.write(json.dumps({"type": "chunks", "request_id": request_id, "space": space,
+                                                     "chunks": chunk_indices, "content_keys": keys}) + "\n")
+                if self._queue.empty():
+                    self._manifest.flush()
+            except Exception as e:
+                logger.error(f"Ошибка записи в хранилище признаков: {e}", exc_info=True)
+
+    def close(self, timeout: float = 10.0):
+        """Дописывает очередь, закрывает шарды и останавливает поток записи."""
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            logger.warning("Хранилище признаков: поток записи не успевает, часть очереди не будет записана.")
+        self._thread.join(timeout)
+        for writer in self._writers.values():
+            writer.close()
+        self._manifest.close()
+
+
+def iter_feature_shards(space_dir: str) -> Iterator[Tuple[List[str], np.ndarray]]:
+    """
+    (ключи, memmap [len(ключи), H, P] fp16) для каждого шарда пространства; данные не читаются в память целиком.
+    Один ключ может встретиться в нескольких шардах (дедупликация при записи только по недавним ключам).
+    """
+    row_shape = read_row_shape(space_dir)
+    if row_shape is None:
+        return
+    for keys_path in sorted(glob.glob(os.path.join(space_dir, "shard-*.keys"))):
+        with open(keys_path, encoding='utf-8') as f:
+            keys = [line.strip() for line in f if line.strip()]
+        if not keys:
+            continue
+        # Хвост файла данных без ключей (сбой между записью данных и ключей) не читается
+        yield keys, np.memmap(keys_path[:-len(".keys")] + ".f16", dtype=FEATURE_DTYPE, mode='r', shape=(len(keys),) + row_shape)
@@ -1,15 +1,14 @@
 import grpc
+import functools
 from concurrent import futures
-import time
+import signal as signal_module # Для graceful shutdown по SIGTERM
 import numpy as np
 import torch
 import os
-import io # Для работы с байтами аудио
-import torchaudio # Для обработки аудио
 import redis # Для взаимодействия с Redis
 from minio import Minio # <--- Добавлен импорт MinIO
 from minio.error import S3Error # <--- Для обработки ошибок MinIO
-from typing import List, Tuple, Optional # Изменено Dict на List
+from typing import Callable, Dict, List, Sequence, Tuple, Optional
 import uuid # Для генерации request_id, если он не приходит
 import logging
 
@@ -19,25 +18,45 @@ logger = logging.getLogger(__name__)
 # Импорт сгенерированного кода
 import audio_analyzer_pb2
 import audio_analyzer_pb2_grpc
+# Стандартный gRPC health checking (пакет grpcio-health-checking)
+from grpc_health.v1 import health, health_pb2, health_pb2_grpc
+
+from warmup import PhaseTimer, run_warmup, WARMUP_ATTEMPTS
+from chunk_store import build_job_key, create_chunk_score_store, CHECKPOINT_WINDOW_CHUNKS
+from audio_budget import DECODED_AUDIO_BUDGET, UNKNOWN_DURATION_EXPANSION_RATIO
+from runtime_config import RuntimeConfig, apply_runtime_config, create_inference_executor
+from inference_scheduler import InferenceScheduler, DeadlineExpired, PRIORITY_LABELS, deadline_passed, request_deadline
+from model_registry import ModelEntry, ModelRegistry, ModelSnapshot
+from shadow_log import ShadowScoreLogger, SHADOW_LOG_FILE, SHADOW_MODEL_NAME
+from feature_store import FeatureStore, chunk_content_key, feature_space_name, FEATURE_STORE_DIR
+from single_flight import SingleFlight, RecordingContext, grpc_time_remaining, SINGLE_FLIGHT_ENABLED
+from metrics import SINGLE_FLIGHT_REQUESTS, start_metrics_server
 
 # Импорт компонентов из inference.py
 from inference import (
-    load_model_from_checkpoint,
-    # CustomWavLMForClassification, # Уже не нужен здесь напрямую, т.к. модель загружается
-    CHECKPOINT_FILE,
+    resolve_precision,
+    INFERENCE_PRECISION,
+    decode_to_chunk_buffer,
+    estimate_decoded_bytes,
+    iter_chunk_batches,
+    INFERENCE_BATCH_SIZE,
+    # CustomWavLMForClassification, # Уже не нужен здесь напрямую, т.к. модели загружает model_registry
     SAMPLE_RATE,
     NUM_SAMPLES,
     # MODEL_CHECKPOINT # Не используется напрямую в этом файле
 )
 
 # Константы для сервера
-_ONE_DAY_IN_SECONDS = 60 * 60 * 24
 _SERVER_ADDRESS = '[::]:50052'
+GRPC_SHUTDOWN_GRACE_SECONDS = float(os.getenv('GRPC_SHUTDOWN_GRACE_SECONDS', '5')) # Время на завершение текущих запросов при остановке
 
 # Константы для Redis
 REDIS_HOST = os.getenv('REDIS_HOST', 'localhost')
 REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
 REDIS_CHUNK_EXPIRY_SECONDS = 3600 # 1 час
+# Redis-стейджинг чанков (SET/MGET каждого чанка перед инференсом). По умолчанию выключен: модель получает
+# срезы буфера чанков напрямую из памяти, а прогресс и так сохраняется чекпоинтами score (chunk_store)
+REDIS_STAGING_ENABLED = os.getenv('REDIS_STAGING_ENABLED', 'False').lower() == 'true'
 
 # Константы для MinIO (из переменных окружения)
 MINIO_ENDPOINT = os.getenv('MINIO_ENDPOINT', 'localhost:9000')
@@ -45,10 +64,30 @@ MINIO_ACCESS_KEY = os.getenv('MINIO_ACCESS_KEY', 'minioadmin') # Пример
 MINIO_SECRET_KEY = os.getenv('MINIO_SECRET_KEY', 'minioadmin') # Пример
 MINIO_SECURE = os.getenv('MINIO_SECURE', 'False').lower() == 'true'
 MINIO_BUCKET_NAME = os.getenv('MINIO_BUCKET_NAME', 'your-audio-bucket')
+MINIO_REGION = os.getenv('MINIO_REGION', 'us-east-1') # Явный регион избавляет от сетевого запроса региона бакета
+
+# Полное имя сервиса для health checking ("audioanalyzer.AudioAnalysis")
+SERVICE_FULL_NAME = audio_analyzer_pb2.DESCRIPTOR.services_by_name['AudioAnalysis'].full_name
 
 # Рассчитываем длительность чанка в секундах
 CHUNK_DURATION_SECONDS = NUM_SAMPLES / SAMPLE_RATE
 
+def format_decode_error(loading_attempt_errors: List[str]) -> str:
+    """Формирует сообщение об ошибке, если ни один из форматов не подошел."""
+    error_details_str = "; ".join(filter(None, loading_attempt_errors)) # filter(None, ...) для удаления пустых строк, если они есть
+    return f"Не удалось загрузить аудиофайл ни в одном из поддерживаемых форматов (wav, mp3, flac, webm). Детали: {error_details_str if error_details_str else 'Конкретных ошибок при попытках загрузки не зарегистрировано.'}"
+
+def reserve_decoding_budget(audio_content_bytes: bytes) -> int:
+    """
+    Резервирует в DECODED_AUDIO_BUDGET место под декодированный файл. Если длительность из заголовка
+    не читается, резерв оценивается по размеру сжатого файла (не больше четверти бюджета);
+    после декодирования резерв уточняется по фактическому буферу (DECODED_AUDIO_BUDGET.resize).
+    """
+    estimated_bytes = estimate_decoded_bytes(audio_content_bytes)
+    if estimated_bytes is None:
+        estimated_bytes = min(len(audio_content_bytes) * UNKNOWN_DURATION_EXPANSION_RATIO, DECODED_AUDIO_BUDGET.max_bytes // 4)
+    return DECODED_AUDIO_BUDGET.reserve(estimated_bytes)
+
 # Используем имя сервиса и сообщения из README.md
 # Если ваши сгенерированные файлы используют другие имена, их нужно будет поправить
 # Например, AudioDetectionServicer вместо AudioSpoofDetectorServicer
@@ -57,28 +96,43 @@ class AudioAnalysisServicer(audio_analyzer_pb2_grpc.AudioAnalysisServicer): # И
 
     def __init__(self):
         super().__init__()
+        # Потоки torch и привязка к ядрам настраиваются до загрузки модели и первого forward
+        self.runtime_config = RuntimeConfig.from_env()
+        apply_runtime_config(self.runtime_config)
+        self.inference_executor = create_inference_executor(self.runtime_config)
+        # Батчи всех запросов проходят через очередь с приоритетами: интерактивные - первыми
+        self.inference_scheduler = InferenceScheduler(self.inference_executor, self.runtime_config.inference_workers)
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         print(f"Используемое устройство для инференса: {self.device}")
         current_dir = os.path.dirname(os.path.abspath(__file__))
-        checkpoint_full_path = os.path.join(current_dir, CHECKPOINT_FILE)
+        self.precision = resolve_precision(INFERENCE_PRECISION, self.device)
+        logger.info(f"Точность инференса: {self.precision} (запрошено: {INFERENCE_PRECISION})")
 
-        print("Загрузка модели...")
-        self.model = load_model_from_checkpoint(checkpoint_full_path, self.device)
-        if self.model is None:
+        print("Загрузка моделей реестра...")
+        # Модели выбираются по имени в запросе; чекпоинты с общим энкодером делят один backbone
+        self.model_registry = ModelRegistry(self.device, self.precision, current_dir)
+        try:
+            self.model_registry.reload()
+        except Exception as e:
             # Эта ошибка должна быть обработана выше, чтобы сервер не стартовал
-            # Но на всякий случай, добавим явный вызов исключения
-            raise RuntimeError("Не удалось загрузить модель. Сервер не может стартовать.")
-        self.model.eval()
-        print("Модель успешно загружена и готова к работе.")
+            raise RuntimeError(f"Не удалось загрузить модели: {e}. Сервер не может стартовать.")
+        self.model_registry.start_watching() # Замена чекпоинтов на лету, без перезапуска
+        print("Модели успешно загружены и готовы к работе.")
 
-        print(f"Подключение к Redis: {REDIS_HOST}:{REDIS_PORT}")
-        try:
-            self.redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0)
-            self.redis_client.ping()
-            print("Успешно подключено к Redis.")
-        except redis.exceptions.ConnectionError as e:
-            print(f"Ошибка подключения к Redis: {e}")
-            self.redis_client = None # Сервис может продолжить работу, но AnalyzeAudio вернет ошибку
+        # Теневой режим: score модели-кандидата пишутся в файл для офлайн-сравнения
+        self.shadow_logger = ShadowScoreLogger() if SHADOW_MODEL_NAME else None
+        if self.shadow_logger is not None:
+            logger.info(f"Теневой режим включен: модель '{SHADOW_MODEL_NAME}', лог {SHADOW_LOG_FILE}")
+        self._shadow_mismatch_warned = set() # Пары (теневая, боевая) модель@ревизия с разными backbone, о которых уже предупредили
+        # Склейка одновременных одинаковых запросов
+        self.single_flight = SingleFlight()
+
+        # Хранилище признаков энкодера для пересчета архива новыми головами (rescore_features.py)
+        self.feature_store = FeatureStore() if FEATURE_STORE_DIR else None
+        if self.feature_store is not None:
+            logger.info(f"Признаки энкодера сохраняются в {FEATURE_STORE_DIR}")
+
+        self._init_redis_clients()
 
         # Инициализация клиента MinIO (без проверки бакета по умолчанию здесь)
         print(f"Инициализация клиента MinIO для эндпоинта: {MINIO_ENDPOINT}, secure: {MINIO_SECURE}")
@@ -87,76 +141,329 @@ class AudioAnalysisServicer(audio_analyzer_pb2_grpc.AudioAnalysisServicer): # И
                 MINIO_ENDPOINT,
                 access_key=MINIO_ACCESS_KEY,
                 secret_key=MINIO_SECRET_KEY,
-                secure=MINIO_SECURE
+                secure=MINIO_SECURE,
+                region=MINIO_REGION
             )
         except Exception as e:
             print(f"Критическая ошибка при инициализации клиента MinIO: {e}")
             # Это критично, без MinIO сервис не сможет работать по новой схеме
             raise RuntimeError(f"Не удалось инициализировать клиент MinIO: {e}")
 
+    def _init_redis_clients(self):
+        """Синхронный клиент Redis (стейджинг чанков) и хранилище чекпоинтов на нем."""
+        print(f"Подключение к Redis: {REDIS_HOST}:{REDIS_PORT}")
+        try:
+            self.redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0)
+            self.redis_client.ping()
+            print("Успешно подключено к Redis.")
+        except redis.exceptions.ConnectionError as e:
+            print(f"Ошибка подключения к Redis: {e}")
+            self.redis_client = None # Сервис может продолжить работу, но AnalyzeAudio вернет ошибку
+
+        # Хранилище посчитанных score чанков для возобновления анализа после сбоя
+        self.chunk_score_store = create_chunk_score_store(self.redis_client)
 
-    def _predict_score_for_chunk_tensor(self, chunk_tensor: torch.Tensor) -> float:
+    def _predict_scores_for_batch(self, batch_tensor: torch.Tensor, model_entry: Optional[ModelEntry] = None,
+                                  shadow_entry: Optional[ModelEntry] = None, pooled_sink=None,
+                                  extra_entries: Sequence[ModelEntry] = ()) -> Tuple[torch.Tensor, Optional[torch.Tensor], Dict[str, torch.Tensor]]:
         """
-        Выполняет предсказание для одного чанка (тензора) и возвращает score (0-1).
-        chunk_tensor должен быть формы [1, NUM_SAMPLES].
+        Выполняет предсказание модели model_entry (по умолчанию - модели по умолчанию) для батча чанков
+        формы [B, NUM_SAMPLES]. Возвращает тензор scores (0-1) формы [B] на CPU, scores теневой модели
+        shadow_entry, посчитанные на тех же признаках энкодера (None, если теневой модели нет или она упала),
+        и scores дополнительных моделей запроса extra_entries по versioned_name.
+        Энкодер считается один раз на backbone для всех моделей вместе.
+        pooled_sink получает признаки энкодера (см. ModelSnapshot.predict_logits).
         """
-        with torch.no_grad():
-            logit = self.model(chunk_tensor.to(self.device))
-        score = torch.sigmoid(logit).item()
-        return score
-
-    def _process_chunk_from_redis(self, request_id_for_redis: str, chunk_idx: int) -> Tuple[Optional[audio_analyzer_pb2.AudioChunkPrediction], Optional[str]]:
+        snapshot = self.model_registry.snapshot()
+        model_entry = model_entry or snapshot.default
+        # Из pinned memory копирование на GPU идет асинхронно
+        logits = snapshot.predict_logits(batch_tensor.to(self.device, non_blocking=True), [model_entry, *extra_entries],
+                                         [shadow_entry] if shadow_entry is not None else (), pooled_sink)
+        shadow_logits = logits.get(shadow_entry.name) if shadow_entry is not None else None
+        shadow_scores = torch.sigmoid(shadow_logits).cpu() if shadow_logits is not None else None
+        extra_scores = {entry.versioned_name: torch.sigmoid(logits[entry.name]).cpu() for entry in extra_entries}
+        return torch.sigmoid(logits[model_entry.name]).cpu(), shadow_scores, extra_scores
+
+    def _resolve_request_models(self, snapshot: ModelSnapshot,
+                                request: audio_analyzer_pb2.AnalyzeAudioRequest) -> Tuple[Optional[ModelEntry], List[ModelEntry], Optional[str]]:
         """
-        Загружает чанк из Redis, выполняет предсказание и возвращает объект AudioChunkPrediction или ошибку.
-        Возвращает (AudioChunkPrediction, None) или (None, error_message)
+        Основная модель запроса и дополнительные модели для A/B (без повторов и без основной).
+        Возвращает (основная, дополнительные, None) или (None, [], сообщение_об_ошибке) для неизвестного имени.
+        """
+        def _unknown(name: str) -> str:
+            return f"Ошибка запроса: неизвестная модель '{name}'. Доступны: {', '.join(sorted(snapshot.entries))}"
+
+        model_entry = snapshot.get(request.model_name)
+        if model_entry is None:
+            return None, [], _unknown(request.model_name)
+        extra_entries = []
+        for name in request.additional_model_names:
+            entry = snapshot.entries.get(name)
+            if entry is None:
+                return None, [], _unknown(name)
+            if entry.name != model_entry.name and entry not in extra_entries:
+                extra_entries.append(entry)
+        return model_entry, extra_entries, None
+
+    def _job_keys(self, model_entries: Sequence[ModelEntry], request: audio_analyzer_pb2.AnalyzeAudioRequest,
+                  object_etag: Optional[str]) -> List[Tuple[str, str]]:
+        """Пары (модель@ревизия, ключ чекпоинта) по одной на модель запроса; пусто, если чекпоинт не ведется."""
+        job_keys = [(entry.versioned_name, build_job_key(entry.versioned_name, request.minio_bucket_name, request.minio_object_key, object_etag))
+                    for entry in model_entries]
+        return [(name, job_key) for name, job_key in job_keys if job_key]
+
+    def _resume_from_checkpoints(self, job_keys: List[Tuple[str, str]], stored_scores: List[Dict[int, float]], num_chunks: int):
+        """
+        Собирает предсказания чанков, которые уже посчитаны всеми моделями запроса (stored_scores - по одному
+        словарю на элемент job_keys, первая модель - основная). Возвращает (тройки_результатов, номера_чанков_для_расчета).
+        """
+        if not job_keys:
+            return [], list(range(num_chunks))
+        primary_scores = stored_scores[0]
+        extra_scores = [(name, scores) for (name, _), scores in zip(job_keys[1:], stored_scores[1:])]
+        results, pending_indices = [], []
+        for chunk_idx in range(num_chunks):
+            if chunk_idx in primary_scores and all(chunk_idx in scores for _, scores in extra_scores):
+                additional = {name: scores[chunk_idx] for name, scores in extra_scores}
+                results.append((chunk_idx, self._build_chunk_prediction(chunk_idx, primary_scores[chunk_idx], additional), None))
+            else:
+                pending_indices.append(chunk_idx)
+        return results, pending_indices
+
+    @staticmethod
+    def _checkpoint_updates(job_keys: List[Tuple[str, str]], batch_results) -> Dict[str, Dict[int, float]]:
+        """{ключ чекпоинта: {chunk_idx: score}} для посчитанных чанков батча, по ключу на каждую модель запроса."""
+        updates = {job_key: {} for _, job_key in job_keys}
+        for chunk_idx, prediction_obj, _ in batch_results:
+            if prediction_obj is None:
+                continue
+            scores = {model_score.model_name: model_score.score for model_score in prediction_obj.additional_scores}
+            for index, (name, job_key) in enumerate(job_keys):
+                score = prediction_obj.score if index == 0 else scores.get(name)
+                if score is not None:
+                    updates[job_key][chunk_idx] = score
+        return updates
+
+    def _shadow_entry_for(self, snapshot: ModelSnapshot, model_entry: ModelEntry) -> Optional[ModelEntry]:
+        """Теневая модель для запроса: только если она делит backbone с боевой (иначе пришлось бы гонять энкодер дважды)."""
+        if self.shadow_logger is None:
+            return None
+        shadow_entry = snapshot.entries.get(SHADOW_MODEL_NAME)
+        if shadow_entry is None or shadow_entry.name == model_entry.name:
+            return None
+        if shadow_entry.backbone_key != model_entry.backbone_key:
+            mismatch = (shadow_entry.versioned_name, model_entry.versioned_name)
+            if mismatch not in self._shadow_mismatch_warned: # Предупреждаем один раз на пару ревизий, а не на каждый запрос
+                self._shadow_mismatch_warned.add(mismatch)
+                logger.warning(f"Теневая модель '{shadow_entry.versioned_name}' использует другой backbone, чем '{model_entry.versioned_name}': теневой score не считается.")
+            return None
+        return shadow_entry
+
+    def _predict_all_models(self, batch_tensor: torch.Tensor):
+        """Прогоняет батч через все backbone и головы реестра (для прогрева)."""
+        snapshot = self.model_registry.snapshot()
+        snapshot.predict_logits(batch_tensor.to(self.device, non_blocking=True), snapshot.entries.values())
+
+    def _warm_up_once(self, timer: PhaseTimer) -> bool:
+        return run_warmup(self._predict_all_models, self.device, timer, inference_executor=self.inference_executor)
+
+    def warm_up(self, timer: PhaseTimer) -> bool:
+        """
+        Прогревает декодер, ресемплеры, модели реестра и пул инференса до того, как сервис будет объявлен готовым.
+        Боевые батчи на это время копятся в очереди планировщика и не занимают потоки пула.
+        Возвращает True, если прогрев удался за WARMUP_ATTEMPTS попыток.
+        """
+        with self.inference_scheduler.paused():
+            for attempt in range(1, WARMUP_ATTEMPTS + 1):
+                if self._warm_up_once(timer):
+                    return True
+                logger.warning(f"Прогрев не удался (попытка {attempt} из {WARMUP_ATTEMPTS}).")
+        return False
+
+    def _store_pooled_features(self, request_id: str, chunk_indices: List[int], batch_tensor: torch.Tensor,
+                               backbone_entry: ModelEntry, pooled: torch.Tensor):
+        """Отправляет признаки энкодера батча в хранилище признаков; ошибки не влияют на ответ."""
+        try:
+            content_keys = [chunk_content_key(chunk) for chunk in batch_tensor]
+            space = feature_space_name(backbone_entry.backbone_key, self.precision)
+            self.feature_store.submit(space, request_id, chunk_indices, content_keys, pooled)
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить признаки чанков {chunk_indices} запроса {request_id}: {e}")
+
+    def _build_chunk_prediction(self, chunk_idx: int, score_value: float,
+                                additional_scores: Optional[Dict[str, float]] = None) -> audio_analyzer_pb2.AudioChunkPrediction:
+        """Формирует AudioChunkPrediction для чанка с номером chunk_idx (additional_scores - {модель@ревизия: score})."""
+        # Округляем значение score до 4 знаков после запятой
+        return audio_analyzer_pb2.AudioChunkPrediction(
+            chunk_id=f"chunk_{chunk_idx}",
+            score=round(score_value, 4),
+            start_time_seconds=chunk_idx * CHUNK_DURATION_SECONDS,
+            end_time_seconds=(chunk_idx + 1) * CHUNK_DURATION_SECONDS,
+            additional_scores=[audio_analyzer_pb2.ModelScore(model_name=name, score=round(score, 4))
+                               for name, score in (additional_scores or {}).items()]
+        )
+
+    def _score_chunk_batch(self, chunk_indices: List[int], batch_tensor: torch.Tensor, request_id: str, model_entry: ModelEntry,
+                           shadow_entry: Optional[ModelEntry] = None,
+                           extra_entries: Sequence[ModelEntry] = ()) -> List[Tuple[int, Optional[audio_analyzer_pb2.AudioChunkPrediction], Optional[str]]]:
+        """
+        Выполняет предсказание модели model_entry для батча [B, NUM_SAMPLES] (обычно срез буфера чанков без копирования).
+        Возвращает по тройке (chunk_idx, AudioChunkPrediction, None) или (chunk_idx, None, error_message) на каждый чанк.
+        Score дополнительных моделей extra_entries попадают в additional_scores предсказаний.
+        Score теневой модели shadow_entry только уходят в фоновый лог и не попадают в результат.
         """
-        chunk_key = f"{request_id_for_redis}:chunk_{chunk_idx}"
-        chunk_id_str = f"chunk_{chunk_idx}"
-        
-        start_time = chunk_idx * CHUNK_DURATION_SECONDS
-        end_time = (chunk_idx + 1) * CHUNK_DURATION_SECONDS
-
         try:
-            chunk_data_bytes = self.redis_client.get(chunk_key)
+            pooled_sink = None
+            if self.feature_store is not None:
+                pooled_sink = functools.partial(self._store_pooled_features, request_id, chunk_indices, batch_tensor)
+            scores, shadow_scores, extra_scores = self._predict_scores_for_batch(batch_tensor, model_entry, shadow_entry, pooled_sink, extra_entries)
+            scores = scores.tolist()
+            extra_scores = {name: extra.tolist() for name, extra in extra_scores.items()}
+        except Exception as e:
+            error_msg = f"Error processing chunks {chunk_indices[0]}-{chunk_indices[-1]} of request {request_id}: {e}"
+            print(error_msg)
+            return [(chunk_idx, None, error_msg) for chunk_idx in chunk_indices]
+        logger.debug(f"LOG_SCORE: request {request_id}, chunks {chunk_indices}, raw scores from model: {scores}")
+        if shadow_scores is not None:
+            self.shadow_logger.log_batch(request_id, chunk_indices, model_entry.versioned_name, scores,
+                                         shadow_entry.versioned_name, shadow_scores.tolist())
+        return [(chunk_idx, self._build_chunk_prediction(chunk_idx, score, {name: extra[i] for name, extra in extra_scores.items()}), None)
+                for i, (chunk_idx, score) in enumerate(zip(chunk_indices, scores))]
+
+    def _batch_from_redis_payloads(self, request_id_for_redis: str, chunk_indices: List[int], payloads: List[Optional[bytes]]):
+        """
+        Собирает батч из байтов чанков, прочитанных из Redis.
+        Возвращает (номера_валидных_чанков, тензор [B, NUM_SAMPLES] или None, тройки_ошибок).
+        """
+        valid_indices, arrays, errors = [], [], []
+        for chunk_idx, chunk_data_bytes in zip(chunk_indices, payloads):
+            chunk_key = f"{request_id_for_redis}:chunk_{chunk_idx}"
             if chunk_data_bytes is None:
-                error_msg = f"Chunk {chunk_key} not found in Redis"
-                print(f"Ошибка: {error_msg}")
-                return None, error_msg
-
+                errors.append((chunk_idx, None, f"Chunk {chunk_key} not found in Redis"))
+                continue
             audio_data_np = np.frombuffer(chunk_data_bytes, dtype=np.float32)
-            
             if audio_data_np.shape[0] != NUM_SAMPLES:
-                error_msg = f"Chunk {chunk_key} has incorrect size. Expected {NUM_SAMPLES}, got {audio_data_np.shape[0]}."
-                print(error_msg)
-                return None, error_msg
+                errors.append((chunk_idx, None, f"Chunk {chunk_key} has incorrect size. Expected {NUM_SAMPLES}, got {audio_data_np.shape[0]}."))
+                continue
+            valid_indices.append(chunk_idx)
+            arrays.append(audio_data_np)
+        batch_tensor = torch.from_numpy(np.stack(arrays)) if arrays else None # Одна копия в непрерывный [B, NUM_SAMPLES]
+        return valid_indices, batch_tensor, errors
+
+    def _stage_chunks_in_redis(self, request_id_for_redis: str, chunk_buffer: torch.Tensor, chunk_indices: List[int], overall_error_message_parts: List[str]) -> List[int]:
+        """
+        Сохраняет строки буфера чанков в Redis одним pipeline. Возвращает номера сохраненных чанков,
+        ошибки добавляет в overall_error_message_parts.
+        """
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for chunk_idx in chunk_indices:
+                # Строка буфера уже float32 и непрерывна: tobytes() - единственная копия
+                pipe.set(f"{request_id_for_redis}:chunk_{chunk_idx}", chunk_buffer[chunk_idx].numpy().tobytes(), ex=REDIS_CHUNK_EXPIRY_SECONDS)
+            pipe.execute()
+            return chunk_indices
+        except redis.exceptions.RedisError as e:
+            # Если не удалось сохранить чанки, нет смысла их обрабатывать
+            error_msg_redis = f"Ошибка сохранения чанков {chunk_indices[0]}-{chunk_indices[-1]} в Redis: {e}"
+            print(error_msg_redis)
+            overall_error_message_parts.append(error_msg_redis)
+            return []
+
+    def _process_chunks_from_redis(self, request_id_for_redis: str, chunk_indices: List[int], model_entry: ModelEntry,
+                                   shadow_entry: Optional[ModelEntry] = None,
+                                   extra_entries: Sequence[ModelEntry] = ()) -> List[Tuple[int, Optional[audio_analyzer_pb2.AudioChunkPrediction], Optional[str]]]:
+        """
+        Загружает батч чанков из Redis (MGET), выполняет предсказание и возвращает тройки
+        (chunk_idx, AudioChunkPrediction, None) или (chunk_idx, None, error_message).
+        """
+        try:
+            payloads = self.redis_client.mget([f"{request_id_for_redis}:chunk_{chunk_idx}" for chunk_idx in chunk_indices])
+        except redis.exceptions.RedisError as e:
+            error_msg = f"Error reading chunks {chunk_indices[0]}-{chunk_indices[-1]} of request {request_id_for_redis} from Redis: {e}"
+            print(error_msg)
+            return [(chunk_idx, None, error_msg) for chunk_idx in chunk_indices]
 
-            input_tensor = torch.from_numpy(audio_data_np).unsqueeze(0) # Добавляем batch dim [1, NUM_SAMPLES]
-            
-            score_value = self._predict_score_for_chunk_tensor(input_tensor)
-            print(f"LOG_SCORE: Chunk {chunk_key} (ID: {chunk_id_str}), Raw Score from model: {score_value}, Type: {type(score_value)}")
-            
-            # Округляем значение score до 4 знаков после запятой
-            score_value_rounded = round(score_value, 4)
-
-            prediction = audio_analyzer_pb2.AudioChunkPrediction(
-                chunk_id=chunk_id_str,
-                score=score_value_rounded, # Используем округленное значение
-                start_time_seconds=start_time,
-                end_time_seconds=end_time
-            )
-            return prediction, None
+        valid_indices, batch_tensor, results = self._batch_from_redis_payloads(request_id_for_redis, chunk_indices, payloads)
+        if batch_tensor is not None:
+            results.extend(self._score_chunk_batch(valid_indices, batch_tensor, request_id_for_redis, model_entry, shadow_entry, extra_entries))
+        return results
 
+    def _single_flight_key(self, request: audio_analyzer_pb2.AnalyzeAudioRequest) -> Optional[Tuple[str, str, Tuple[str, ...], int]]:
+        """
+        Ключ склейки одинаковых запросов: (бакет, объект, модели@ревизии запроса, приоритет). Строится без обращения
+        к MinIO; совпадение содержимого проверяет только склеенный запрос (см. _object_etag_matches).
+        Приоритет входит в ключ, чтобы интерактивный запрос не ждал в очереди вместе с фоновым.
+        None - запрос обрабатывается отдельно (склейка выключена или модель неизвестна; ошибку вернет обычный путь).
+        """
+        if not SINGLE_FLIGHT_ENABLED or not request.minio_bucket_name or not request.minio_object_key:
+            return None
+        model_entry, extra_entries, _ = self._resolve_request_models(self.model_registry.snapshot(), request)
+        if model_entry is None:
+            return None
+        model_names = tuple(entry.versioned_name for entry in [model_entry, *extra_entries])
+        return request.minio_bucket_name, request.minio_object_key, model_names, request.priority
+
+    def _object_etag_matches(self, request: audio_analyzer_pb2.AnalyzeAudioRequest, leader_etag: Optional[str]) -> bool:
+        """
+        Склеенный запрос принимает чужой результат, только если объект не менялся: текущий ETag совпадает с ETag,
+        который инициатор получил при скачивании. Без ETag инициатора или при ошибке stat_object - не принимает.
+        """
+        if not leader_etag:
+            return False
+        try:
+            etag = self.minio_client.stat_object(request.minio_bucket_name, request.minio_object_key).etag
         except Exception as e:
-            error_msg = f"Error processing chunk {chunk_key}: {e}"
-            print(error_msg)
-            return None, error_msg
-
+            logger.debug(f"stat_object для проверки single-flight не удался: {e}")
+            return False
+        return bool(etag) and etag.strip('"') == leader_etag
 
     # Это новый основной метод согласно README.md
     def AnalyzeAudio(self, request: audio_analyzer_pb2.AnalyzeAudioRequest, context) -> audio_analyzer_pb2.AnalyzeAudioResponse:
         """
+        Точка входа RPC. Одновременные запросы одного и того же объекта с теми же моделями
+        склеиваются: анализ выполняет первый, остальные дожидаются и получают его ответ и статус,
+        если объект с момента его скачивания не изменился (иначе считают сами).
+        Дедлайн общего анализа - дедлайн первого запроса; если истек только он, остальные досчитывают сами.
+        """
+        flight_key = self._single_flight_key(request)
+        if flight_key is None:
+            return self._analyze_audio(request, context)
+        deadline = request_deadline(context)
+
+        def _run_analysis():
+            recording_context = RecordingContext(context)
+            return self._analyze_audio(request, recording_context, recording_context.record_object_etag), recording_context
+
+        while True:
+            try:
+                (response, recording_context), shared = self.single_flight.do(flight_key, _run_analysis, timeout=grpc_time_remaining(context))
+            except TimeoutError as e:
+                context.set_code(grpc.StatusCode.DEADLINE_EXCEEDED)
+                context.set_details(str(e))
+                return audio_analyzer_pb2.AnalyzeAudioResponse(error_message=str(e))
+            if not (shared and recording_context.code == grpc.StatusCode.DEADLINE_EXCEEDED and not deadline_passed(deadline)):
+                break
+            # Истек дедлайн запроса-инициатора, а не этого: посчитанные чанки уже в чекпоинте, остальные досчитываются
+            # новым общим анализом - повторы ожидавших запросов склеиваются между собой
+            logger.info(f"Общий анализ {flight_key[0]}/{flight_key[1]} прерван по чужому дедлайну, повтор через single-flight")
+            SINGLE_FLIGHT_REQUESTS.labels(role='rerun').inc()
+        if shared and not self._object_etag_matches(request, recording_context.object_etag):
+            logger.info(f"Объект {flight_key[0]}/{flight_key[1]} изменился после скачивания общим анализом, анализ без склейки")
+            SINGLE_FLIGHT_REQUESTS.labels(role='stale').inc()
+            return self._analyze_audio(request, context)
+        if shared:
+            logger.info(f"Запрос {flight_key[0]}/{flight_key[1]} склеен с уже выполняющимся анализом")
+            recording_context.replay(context)
+        SINGLE_FLIGHT_REQUESTS.labels(role='coalesced' if shared else 'leader').inc()
+        return response
+
+    def _analyze_audio(self, request: audio_analyzer_pb2.AnalyzeAudioRequest, context,
+                       on_object_etag: Optional[Callable[[Optional[str]], None]] = None) -> audio_analyzer_pb2.AnalyzeAudioResponse:
+        """
         Обрабатывает полный аудиофайл: скачивает из MinIO, нарезает на чанки, 
         сохраняет в Redis, параллельно обрабатывает чанки и возвращает агрегированный результат.
+        Посчитанные чанки сохраняются в чекпоинт (ключ - ETag объекта), повторный запрос считает только недостающие.
+        on_object_etag получает ETag скачанного объекта (проверка склеенных запросов в AnalyzeAudio).
         """
         # Генерируем внутренний ID для использования с Redis, т.к. request_id не приходит
         # В будущем здесь можно использовать request.task_id, если он будет добавлен
@@ -164,7 +471,7 @@ class AudioAnalysisServicer(audio_analyzer_pb2_grpc.AudioAnalysisServicer): # И
 
         print(f"Получен запрос AnalyzeAudio. Bucket: '{request.minio_bucket_name}', Key: '{request.minio_object_key}'. Internal Redis ID: {internal_request_id_for_redis}")
 
-        if self.redis_client is None:
+        if REDIS_STAGING_ENABLED and self.redis_client is None:
             error_msg = "Ошибка сервера: Redis недоступен."
             print(error_msg)
             context.set_code(grpc.StatusCode.UNAVAILABLE)
@@ -179,12 +486,28 @@ class AudioAnalysisServicer(audio_analyzer_pb2_grpc.AudioAnalysisServicer): # И
             context.set_details(error_msg)
             return audio_analyzer_pb2.AnalyzeAudioResponse(error_message=error_msg)
 
+        # Снимок реестра фиксируется на весь запрос: замена чекпоинта на лету его не затронет
+        model_snapshot = self.model_registry.snapshot()
+        model_entry, extra_entries, error_msg = self._resolve_request_models(model_snapshot, request)
+        if model_entry is None:
+            print(error_msg)
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(error_msg)
+            return audio_analyzer_pb2.AnalyzeAudioResponse(error_message=error_msg)
+        shadow_entry = self._shadow_entry_for(model_snapshot, model_entry)
+        # Класс приоритета и дедлайн клиента определяют место батчей запроса в очереди инференса
+        priority = request.priority
+        deadline = request_deadline(context)
+        deadline_expired = False
+
         predictions_list: List[audio_analyzer_pb2.AudioChunkPrediction] = []
         overall_error_message_parts = []
+        decoded_budget_bytes = 0
 
         try:
             # 1. Скачивание аудиофайла из MinIO
             audio_content_bytes = None
+            object_etag = None
             if not request.minio_bucket_name or not request.minio_object_key:
                 error_msg = "Ошибка запроса: minio_bucket_name или minio_object_key не указаны."
                 print(error_msg)
@@ -203,6 +526,9 @@ class AudioAnalysisServicer(audio_analyzer_pb2_grpc.AudioAnalysisServicer): # И
                     return audio_analyzer_pb2.AnalyzeAudioResponse(error_message=error_msg)
                 
                 response_minio = self.minio_client.get_object(request.minio_bucket_name, request.minio_object_key)
+                object_etag = response_minio.headers.get('ETag') # Ключ для чекпоинтов посчитанных чанков
+                if on_object_etag is not None:
+                    on_object_etag(object_etag)
                 audio_content_bytes = response_minio.read()
             except S3Error as s3_err:
                 error_msg = f"Ошибка MinIO при скачивании файла '{request.minio_object_key}' из бакета '{request.minio_bucket_name}': {s3_err}"
@@ -235,40 +561,12 @@ class AudioAnalysisServicer(audio_analyzer_pb2_grpc.AudioAnalysisServicer): # И
             print(f"Файл из MinIO успешно загружен, размер: {len(audio_content_bytes)} байт.")
 
             # 2. Загрузка и предобработка аудио (теперь из audio_content_bytes)
-            signal = None 
-            sr = None     
-            # overall_error_message_parts уже определен в начале метода AnalyzeAudio.
-            loading_attempt_errors = [] # Локальный список ошибок для этой сессии загрузки
-
+            # Ждем, пока суммарный объем декодированного аудио в работе позволит декодировать этот файл
+            decoded_budget_bytes = reserve_decoding_budget(audio_content_bytes)
             try:
-                for format_to_try in ["wav", "mp3", "flac", "webm", "ogg"]:
-                    # Создаем НОВЫЙ поток для КАЖДОЙ попытки формата
-                    audio_stream_for_format = io.BytesIO(audio_content_bytes)
-                    try:
-                        signal, sr = torchaudio.load(audio_stream_for_format, format=format_to_try)
-                        print(f"Файл успешно загружен в формате: {format_to_try}") 
-                        loading_attempt_errors.clear() # Успех, очищаем ошибки этой сессии
-                        break # Выходим из цикла, так как аудио успешно загружено
-                    except Exception as e:
-                        error_msg_format = f"Ошибка при попытке загрузки файла в формате {format_to_try}: {e}"
-                        print(error_msg_format)
-                        loading_attempt_errors.append(error_msg_format)
-                        signal, sr = None, None # Сбрасываем, так как этот формат не удался
-                        # audio_stream_for_format закроется автоматически сборщиком мусора
-                        continue # Переходим к следующему формату
-                
-                if signal is None or sr is None: # Если ни один формат не подошел
-                    overall_error_message_parts.extend(loading_attempt_errors) 
-                    error_details_str = "; ".join(filter(None, overall_error_message_parts)) # filter(None, ...) для удаления пустых строк, если они есть
-                    final_error_msg = f"Не удалось загрузить аудиофайл ни в одном из поддерживаемых форматов (wav, mp3, flac, webm). Детали: {error_details_str if error_details_str else 'Конкретных ошибок при попытках загрузки не зарегистрировано.'}"
-                    print(final_error_msg)
-                    context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
-                    context.set_details(final_error_msg)
-                    return audio_analyzer_pb2.AnalyzeAudioResponse(error_message=final_error_msg)
-            
+                # Моно, ресемплинг и паддинг сразу в один буфер [num_chunks, NUM_SAMPLES]; на GPU - в pinned memory
+                chunk_buffer, total_samples, loading_attempt_errors = decode_to_chunk_buffer(audio_content_bytes, pin_memory=self.device.type == "cuda")
             except Exception as e_outer: # Ловим другие неожиданные ошибки в этом блоке
-                if loading_attempt_errors: # Добавляем ошибки попыток загрузки, если они были до этого исключения
-                    overall_error_message_parts.extend(loading_attempt_errors)
                 overall_error_message_parts.append(f"Неожиданная общая ошибка на этапе загрузки аудио: {e_outer}")
                 final_error_msg_outer = f"Общая ошибка при обработке аудио для загрузки. Детали: {'; '.join(filter(None, overall_error_message_parts))}"
                 print(final_error_msg_outer)
@@ -276,131 +574,103 @@ class AudioAnalysisServicer(audio_analyzer_pb2_grpc.AudioAnalysisServicer): # И
                 context.set_details(final_error_msg_outer)
                 return audio_analyzer_pb2.AnalyzeAudioResponse(error_message=final_error_msg_outer)
 
-            # Защитная проверка: если signal или sr все еще None, это указывает на проблему в логике выше.
-            if signal is None or sr is None:
-                 # Эта ситуация не должна возникать, если предыдущая логика возвращает ошибку корректно.
-                 critical_fallback_msg = "Критическая ошибка: аудио не было загружено (signal или sr is None) после блока попыток загрузки, несмотря на проверки."
-                 if overall_error_message_parts:
-                     critical_fallback_msg += " Собранные ошибки: " + "; ".join(filter(None, overall_error_message_parts))
-                 elif loading_attempt_errors: # Если overall_error_message_parts пуст, но были локальные ошибки
-                     critical_fallback_msg += " Локальные ошибки загрузки: " + "; ".join(filter(None, loading_attempt_errors))
-                 print(critical_fallback_msg)
-                 context.set_code(grpc.StatusCode.INTERNAL)
-                 context.set_details(critical_fallback_msg)
-                 return audio_analyzer_pb2.AnalyzeAudioResponse(error_message=critical_fallback_msg)
-
-            # 1.1 Ресемплинг
-            if sr != SAMPLE_RATE:
-                resampler = torchaudio.transforms.Resample(sr, SAMPLE_RATE)
-                signal = resampler(signal)
-            
-            # 1.2 Моно
-            if signal.shape[0] > 1:
-                signal = torch.mean(signal, dim=0, keepdim=True)
-            
-            # Убираем размерность канала -> [num_samples_total]
-            signal = signal.squeeze(0) 
-            total_samples = signal.shape[0]
-            num_chunks_calculated = (total_samples + NUM_SAMPLES - 1) // NUM_SAMPLES # Округление вверх
-
-            if num_chunks_calculated == 0 and total_samples > 0: # если аудио короче одного чанка, но не пустое
-                num_chunks_calculated = 1
-            elif total_samples == 0:
+            if chunk_buffer is None: # Если ни один формат не подошел
+                final_error_msg = format_decode_error(loading_attempt_errors)
+                print(final_error_msg)
+                context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+                context.set_details(final_error_msg)
+                return audio_analyzer_pb2.AnalyzeAudioResponse(error_message=final_error_msg)
+
+            if total_samples == 0:
                 error_msg = "Аудиофайл пуст или не содержит аудиоданных после предобработки."
                 print(error_msg)
                 context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
                 context.set_details(error_msg)
                 return audio_analyzer_pb2.AnalyzeAudioResponse(error_message=error_msg)
 
-
+            # До конца запроса в памяти остается только буфер чанков: резерв приводится к его размеру
+            decoded_budget_bytes = DECODED_AUDIO_BUDGET.resize(decoded_budget_bytes, chunk_buffer.nbytes)
+            num_chunks_calculated = chunk_buffer.shape[0]
             print(f"Аудиофайл предобработан. Всего семплов: {total_samples}, будет чанков: {num_chunks_calculated}")
 
-            # 3. Нарезка на чанки, сохранение в Redis и планирование обработки
-            # Используем ThreadPoolExecutor для параллельной обработки чанков из Redis
-            # Это может быть не самым лучшим решением для IO-bound операций с Redis, 
-            # но для CPU-bound инференса это может дать выигрыш.
-            # Альтернатива - asyncio с подходящим Redis клиентом, если весь стек асинхронный.
-
-            # Сохраняем чанки в Redis
-            chunk_indices_to_process = []
-            for i in range(num_chunks_calculated):
-                start_sample = i * NUM_SAMPLES
-                end_sample = start_sample + NUM_SAMPLES
-
-                # Паддинг для последнего чанка, если он короче
-                if end_sample > total_samples:
-                    chunk_signal_np = signal[start_sample:].numpy()
-                    padding_needed = NUM_SAMPLES - len(chunk_signal_np)
-                    if padding_needed > 0: # Только если действительно нужен паддинг
-                         chunk_signal_np = np.pad(chunk_signal_np, (0, padding_needed), 'constant')
-                else:
-                    chunk_signal_np = signal[start_sample:end_sample].numpy()
-
-                if chunk_signal_np.shape[0] != NUM_SAMPLES:
-                     # Этого не должно произойти с правильным паддингом/нарезкой, но на всякий случай
-                    print(f"Предупреждение: Чанк {i} после нарезки/паддинга имеет размер {chunk_signal_np.shape[0]}, ожидалось {NUM_SAMPLES}")
-                    # Можно пропустить этот чанк или вернуть ошибку
-                    overall_error_message_parts.append(f"Chunk {i} has wrong size after slicing/padding.")
-                    continue
-
-                chunk_key = f"{internal_request_id_for_redis}:chunk_{i}"
-                try:
-                    self.redis_client.set(chunk_key, chunk_signal_np.astype(np.float32).tobytes(), ex=REDIS_CHUNK_EXPIRY_SECONDS)
-                    chunk_indices_to_process.append(i)
-                except redis.exceptions.RedisError as e:
-                    error_msg_redis = f"Ошибка сохранения чанка {i} в Redis: {e}"
-                    print(error_msg_redis)
-                    overall_error_message_parts.append(error_msg_redis)
-                    # Если не удалось сохранить чанк, нет смысла его обрабатывать
-            
-            if not chunk_indices_to_process: # Если не удалось сохранить ни одного чанка
-                 if not overall_error_message_parts: # Если и ошибок не было (например, пустой файл дал 0 чанков)
-                      overall_error_message_parts.append("No chunks were processed or saved to Redis.")
-                 final_error_msg = " | ".join(overall_error_message_parts)
-                 context.set_code(grpc.StatusCode.INTERNAL)
-                 context.set_details(final_error_msg)
-                 return audio_analyzer_pb2.AnalyzeAudioResponse(error_message=final_error_msg)
-
-            # 4. Параллельная обработка чанков из Redis
-            results = [] # Список из Tuple[Optional[AudioChunkPrediction], Optional[str]]
-
-            # Используем ThreadPoolExecutor для параллельной обработки
-            # Оптимальное число воркеров зависит от системы и характера нагрузки.
-            # Если модель на GPU, то CPU-воркеров может быть немного.
-            # Если модель на CPU, то число воркеров должно быть соизмеримо с CPU ядрами.
-            # Учитываем, что gRPC сервер сам использует ThreadPoolExecutor.
-            num_workers = min(8, (os.cpu_count() or 4)) # Ограничим 8 воркерами или числом ядер (минимум 4)
-            # print(f"Используется ThreadPoolExecutor с {num_workers} воркерами для обработки чанков.") # Можно заменить на logger.debug
-            logger.info(f"Using ThreadPoolExecutor with {num_workers} workers for chunk processing for request {internal_request_id_for_redis}")
-
-            with futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+            # 3. Чекпоинт: чанки, посчитанные прошлыми попытками для этого же файла (ETag), не пересчитываются
+            # Чекпоинт ведется отдельно для каждой модели запроса; чанк пересчитывается, если его нет хотя бы у одной
+            job_keys = self._job_keys([model_entry, *extra_entries], request, object_etag)
+            stored_scores = [self.chunk_score_store.load(job_key) for _, job_key in job_keys]
+            if shadow_entry is not None:
+                self.shadow_logger.log_request(internal_request_id_for_redis, request.minio_bucket_name, request.minio_object_key, object_etag)
+            if self.feature_store is not None:
+                self.feature_store.log_request(internal_request_id_for_redis, request.minio_bucket_name, request.minio_object_key, object_etag)
+            # results - список из Tuple[chunk_idx, Optional[AudioChunkPrediction], Optional[str]]
+            results, pending_indices = self._resume_from_checkpoints(job_keys, stored_scores, num_chunks_calculated)
+            if results:
+                logger.info(f"Возобновление анализа {job_keys[0][1]}: {len(results)} из {num_chunks_calculated} чанков взяты из чекпоинта")
+
+            # 4. Обработка окнами по CHECKPOINT_WINDOW_CHUNKS: в Redis одновременно лежит не больше одного окна,
+            # а каждый посчитанный чанк сразу попадает в чекпоинт. Модель получает батчи по INFERENCE_BATCH_SIZE.
+            # Батчи идут в общий для всех запросов пул инференса (INFERENCE_WORKERS потоков по intra_op потоков torch),
+            # поэтому параллельные запросы не умножают число потоков сверх числа ядер. Порядок батчей в пуле
+            # задает inference_scheduler; после истечения дедлайна новые окна не начинаются.
+            for window_start in range(0, len(pending_indices), CHECKPOINT_WINDOW_CHUNKS):
+                if deadline_expired or deadline_passed(deadline):
+                    deadline_expired = True
+                    break
+                window_indices = pending_indices[window_start:window_start + CHECKPOINT_WINDOW_CHUNKS]
+
                 # Отправляем задачи на выполнение
-                future_to_chunk_idx = {
-                    executor.submit(self._process_chunk_from_redis, internal_request_id_for_redis, chunk_idx): chunk_idx 
-                    for chunk_idx in chunk_indices_to_process
-                }
+                if REDIS_STAGING_ENABLED:
+                    chunk_indices_to_process = self._stage_chunks_in_redis(internal_request_id_for_redis, chunk_buffer, window_indices, overall_error_message_parts)
+                    future_to_chunk_indices = {
+                        self.inference_scheduler.submit(priority, deadline, self._process_chunks_from_redis, internal_request_id_for_redis, chunk_indices_to_process[i:i + INFERENCE_BATCH_SIZE], model_entry, shadow_entry, extra_entries): chunk_indices_to_process[i:i + INFERENCE_BATCH_SIZE]
+                        for i in range(0, len(chunk_indices_to_process), INFERENCE_BATCH_SIZE)
+                    }
+                else:
+                    chunk_indices_to_process = []
+                    future_to_chunk_indices = {
+                        self.inference_scheduler.submit(priority, deadline, self._score_chunk_batch, batch_indices, batch_tensor, internal_request_id_for_redis, model_entry, shadow_entry, extra_entries): batch_indices
+                        for batch_indices, batch_tensor in iter_chunk_batches(chunk_buffer, window_indices, INFERENCE_BATCH_SIZE)
+                    }
                 
-                for future in futures.as_completed(future_to_chunk_idx):
-                    chunk_idx_completed = future_to_chunk_idx[future]
+                for future in futures.as_completed(future_to_chunk_indices):
+                    chunk_indices_completed = future_to_chunk_indices[future]
                     try:
-                        prediction_obj, error_str = future.result() # Получаем результат выполнения
-                        results.append((prediction_obj, error_str))
-                        if error_str:
-                             logger.warning(f"Error processing chunk {chunk_idx_completed} for request {internal_request_id_for_redis}: {error_str}")
-                        # Опционально: удаляем чанк из Redis после успешной обработки или всегда
-                        # chunk_key_to_delete = f"{internal_request_id_for_redis}:chunk_{chunk_idx_completed}"
-                        # try:
-                        #    self.redis_client.delete(chunk_key_to_delete)
-                        # except redis.exceptions.RedisError as e_del:
-                        #    logger.warning(f"Error deleting chunk {chunk_key_to_delete} from Redis: {e_del}")
+                        batch_results = future.result() # Получаем результат выполнения
+                        for chunk_idx, prediction_obj, error_str in batch_results:
+                            results.append((chunk_idx, prediction_obj, error_str))
+                            if error_str:
+                                 logger.warning(f"Error processing chunk {chunk_idx} for request {internal_request_id_for_redis}: {error_str}")
+                        for job_key, batch_scores in self._checkpoint_updates(job_keys, batch_results).items():
+                            self.chunk_score_store.save_many(job_key, batch_scores) # Один pipeline на батч и модель
+                    except DeadlineExpired:
+                        deadline_expired = True # Батч снят с очереди планировщиком, а не упал
                     except Exception as exc:
-                        error_msg_future = f"Исключение при обработке чанка {chunk_idx_completed} в потоке: {exc}"
+                        error_msg_future = f"Исключение при обработке чанков {chunk_indices_completed} в потоке: {exc}"
                         print(error_msg_future) # Оставляем print для быстрой отладки, но также логируем
-                        logger.error(f"Exception while processing chunk {chunk_idx_completed} in thread for request {internal_request_id_for_redis}", exc_info=True)
-                        results.append((None, error_msg_future)) # Добавляем ошибку в результаты
+                        logger.error(f"Exception while processing chunks {chunk_indices_completed} in thread for request {internal_request_id_for_redis}", exc_info=True)
+                        results.extend((chunk_idx, None, error_msg_future) for chunk_idx in chunk_indices_completed)
+
+                # Чанки окна больше не нужны в Redis
+                if chunk_indices_to_process:
+                    try:
+                        self.redis_client.delete(*(f"{internal_request_id_for_redis}:chunk_{i}" for i in chunk_indices_to_process))
+                    except redis.exceptions.RedisError as e_del:
+                        logger.warning(f"Error deleting chunks of request {internal_request_id_for_redis} from Redis: {e_del}")
+
+            if deadline_expired:
+                error_msg = (f"Дедлайн запроса истек: посчитано {len(results)} из {num_chunks_calculated} чанков "
+                             f"({PRIORITY_LABELS.get(priority, priority)}).")
+                if job_keys:
+                    error_msg += " Посчитанные чанки сохранены в чекпоинт, повторный запрос продолжит с них."
+                print(error_msg)
+                context.set_code(grpc.StatusCode.DEADLINE_EXCEEDED)
+                context.set_details(error_msg)
+                return audio_analyzer_pb2.AnalyzeAudioResponse(error_message=error_msg, model_name=model_entry.versioned_name)
+
+            if not results and not overall_error_message_parts:
+                overall_error_message_parts.append("No chunks were processed or saved to Redis.")
             
             # Сбор результатов
-            for pred_obj, err_str in results:
+            for _, pred_obj, err_str in results:
                 if pred_obj:
                     predictions_list.append(pred_obj)
                 if err_str:
@@ -424,11 +694,11 @@ class AudioAnalysisServicer(audio_analyzer_pb2_grpc.AudioAnalysisServicer): # И
                     context.set_code(grpc.StatusCode.INTERNAL) # или другой подходящий код
                     context.set_details(final_error_msg)
                     # Возвращаем ответ с ошибкой, но без predictions, если они пусты
-                    return audio_analyzer_pb2.AnalyzeAudioResponse(error_message=final_error_msg)
+                    return audio_analyzer_pb2.AnalyzeAudioResponse(error_message=final_error_msg, model_name=model_entry.versioned_name)
 
 
-            print(f"Анализ завершен для {internal_request_id_for_redis}. Предсказаний: {len(predictions_list)}. Ошибки: '{final_error_msg if final_error_msg else 'Нет'}'")
-            return audio_analyzer_pb2.AnalyzeAudioResponse(predictions=predictions_list, error_message=final_error_msg)
+            print(f"Анализ завершен для {internal_request_id_for_redis} ({model_entry.versioned_name}). Предсказаний: {len(predictions_list)}. Ошибки: '{final_error_msg if final_error_msg else 'Нет'}'")
+            return audio_analyzer_pb2.AnalyzeAudioResponse(predictions=predictions_list, error_message=final_error_msg, model_name=model_entry.versioned_name)
 
         except Exception as e:
             # Глобальный обработчик ошибок для метода AnalyzeAudio
@@ -438,9 +708,11 @@ class AudioAnalysisServicer(audio_analyzer_pb2_grpc.AudioAnalysisServicer): # И
             context.set_details(critical_error_msg)
             # Убедимся, что возвращаем список предсказаний, даже если он пуст
             return audio_analyzer_pb2.AnalyzeAudioResponse(predictions=predictions_list, error_message=critical_error_msg)
+        finally:
+            DECODED_AUDIO_BUDGET.release(decoded_budget_bytes)
 
     # Старый метод PredictChunk больше не нужен в таком виде, так как его логика
-    # инкапсулирована в _predict_score_for_chunk_tensor и _process_chunk_from_redis.
+    # инкапсулирована в _score_chunk_batch и _process_chunks_from_redis.
     # Если он определен в proto и ожидается, его нужно будет адаптировать или удалить из proto.
     # Пока что я его закомментирую, предполагая, что основным является ProcessAudio.
     # def PredictChunk(self, request, context):
@@ -452,9 +724,11 @@ def serve():
     """Запускает gRPC сервер."""
     # Инициализация сервисера для проверки загрузки модели и других зависимостей.
     # Логгер уже должен быть настроен к этому моменту (в if __name__ == '__main__').
+    timer = PhaseTimer()
     try:
         logger.info("Попытка инициализации AudioAnalysisServicer...")
-        servicer_instance = AudioAnalysisServicer() 
+        with timer.measure("init_servicer"):
+            servicer_instance = AudioAnalysisServicer() 
         logger.info("AudioAnalysisServicer успешно инициализирован.")
     except RuntimeError as e:
         print(f"КРИТИЧЕСКАЯ ОШИБКА при инициализации AudioAnalysisServicer (RuntimeError): {e}")
@@ -474,31 +748,62 @@ def serve():
     audio_analyzer_pb2_grpc.add_AudioAnalysisServicer_to_server(
         servicer_instance, server # Используем уже созданный и проверенный экземпляр
     )
+
+    # Health checking: до окончания прогрева сервис отвечает NOT_SERVING
+    health_servicer = health.HealthServicer()
+    health_pb2_grpc.add_HealthServicer_to_server(health_servicer, server)
+    for service_name in ("", SERVICE_FULL_NAME):
+        health_servicer.set(service_name, health_pb2.HealthCheckResponse.NOT_SERVING)
     
     server.add_insecure_port(_SERVER_ADDRESS) # Используем константу _SERVER_ADDRESS
     print(f"Сервер gRPC слушает на {_SERVER_ADDRESS}")
     logger.info(f"Сервер gRPC слушает на {_SERVER_ADDRESS}")
     
-    server.start()
+    with timer.measure("server_start"):
+        server.start()
     print("Сервер gRPC успешно запущен.")
     logger.info("Сервер gRPC успешно запущен.")
-    
+    start_metrics_server()
+
+    if servicer_instance.warm_up(timer):
+        for service_name in ("", SERVICE_FULL_NAME):
+            health_servicer.set(service_name, health_pb2.HealthCheckResponse.SERVING)
+        timer.log_summary()
+        logger.info("Прогрев завершен, сервис объявлен готовым (SERVING).")
+    else:
+        # Непрогретый сервер не объявляется готовым: останавливаемся, чтобы оркестратор перезапустил процесс
+        logger.critical("Прогрев не удался, сервис остается NOT_SERVING. Остановка сервера.")
+        server.stop(grace=GRPC_SHUTDOWN_GRACE_SECONDS)
+
+    def _handle_sigterm(signum, frame):
+        # Снимаем готовность, перестаем принимать новые запросы и даем текущим завершиться
+        logger.info(f"Получен сигнал {signum}. Остановка сервера (grace={GRPC_SHUTDOWN_GRACE_SECONDS} с)...")
+        health_servicer.enter_graceful_shutdown()
+        server.stop(grace=GRPC_SHUTDOWN_GRACE_SECONDS)
+
+    signal_module.signal(signal_module.SIGTERM, _handle_sigterm)
+
     try:
-        while True:
-            time.sleep(_ONE_DAY_IN_SECONDS)
+        server.wait_for_termination()
     except KeyboardInterrupt:
         print("Получен сигнал KeyboardInterrupt. Остановка сервера...")
         logger.info("Получен сигнал KeyboardInterrupt. Остановка сервера...")
     finally:
-        shutdown_event = server.stop(grace=5) # Даем 5 секунд на graceful shutdown
+        shutdown_event = server.stop(grace=GRPC_SHUTDOWN_GRACE_SECONDS)
         print("Ожидание завершения работы сервера...")
         logger.info("Ожидание завершения работы сервера...")
         shutdown_event.wait() # Блокируемся до полной остановки
+        servicer_instance.inference_scheduler.shutdown(wait=True)
+        servicer_instance.model_registry.stop_watching()
+        if servicer_instance.shadow_logger is not None:
+            servicer_instance.shadow_logger.close()
+        if servicer_instance.feature_store is not None:
+            servicer_instance.feature_store.close()
         print("Сервер gRPC полностью остановлен.")
         logger.info("Сервер gRPC полностью остановлен.")
 
-if __name__ == '__main__':
-    # Настройка логирования должна быть в самом начале.
+def configure_logging() -> str:
+    """Настраивает корневой логгер по LOG_LEVEL. Возвращает имя примененного уровня."""
     log_level_str = os.getenv('LOG_LEVEL', 'INFO').upper()
     log_format = '%(asctime)s - %(name)s - %(levelname)s - %(process)d - %(threadName)s - %(message)s'
     
@@ -513,14 +818,17 @@ if __name__ == '__main__':
         format=log_format,
         handlers=[
             logging.StreamHandler() # Вывод в stderr по умолчанию
-        ]
+        ],
+        force=True # inference.py при импорте уже вызывает basicConfig
     )
-    # logger = logging.getLogger(__name__) # Получаем логгер для текущего модуля, если нужно специфичное имя
-
     # Пример установки уровня для других логгеров, если они слишком "шумные"
     # logging.getLogger('minio').setLevel(logging.WARNING)
     # logging.getLogger('urllib3').setLevel(logging.WARNING) # MinIO использует urllib3
     # logging.getLogger('redis').setLevel(logging.WARNING)
+    return log_level_str
 
+if __name__ == '__main__':
+    # Настройка логирования должна быть в самом начале.
+    log_level_str = configure_logging()
     logger.info(f"Запуск gRPC сервера из __main__ с уровнем логирования {log_level_str}...")
-    serve()
\ No newline at end of file
+    serve()
@@ -0,0 +1,439 @@
+import asyncio
+import os
+import signal as signal_module
+import uuid
+import logging
+from concurrent import futures
+from datetime import timedelta
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import aiohttp # Асинхронное скачивание объектов из MinIO по presigned URL
+import grpc
+import redis.asyncio as aioredis # Асинхронный клиент Redis (входит в пакет redis>=4.2)
+import torch
+
+import audio_analyzer_pb2
+import audio_analyzer_pb2_grpc
+from grpc_health.v1 import health, health_pb2, health_pb2_grpc
+
+from warmup import PhaseTimer, run_warmup
+from chunk_store import create_async_chunk_score_store, CHECKPOINT_WINDOW_CHUNKS
+from audio_budget import DECODED_AUDIO_BUDGET
+
+from inference import decode_to_chunk_buffer, iter_chunk_batches, INFERENCE_BATCH_SIZE
+from model_registry import ModelEntry
+from inference_scheduler import DeadlineExpired, PRIORITY_LABELS, deadline_passed, request_deadline
+from single_flight import AsyncSingleFlight, RecordingContext, grpc_time_remaining
+from metrics import SINGLE_FLIGHT_REQUESTS, start_metrics_server
+from grpc_server import (
+    AudioAnalysisServicer,
+    configure_logging,
+    format_decode_error,
+    reserve_decoding_budget,
+    GRPC_SHUTDOWN_GRACE_SECONDS,
+    SERVICE_FULL_NAME,
+    REDIS_HOST,
+    REDIS_PORT,
+    REDIS_CHUNK_EXPIRY_SECONDS,
+    REDIS_STAGING_ENABLED,
+    _SERVER_ADDRESS,
+)
+
+logger = logging.getLogger(__name__)
+
+# Константы для асинхронного сервера
+AIO_MAX_CONCURRENT_RPCS = int(os.getenv('AIO_MAX_CONCURRENT_RPCS', '1000')) # Сколько запросов может ждать I/O одновременно
+AIO_DECODE_WORKERS = int(os.getenv('AIO_DECODE_WORKERS', '2')) # Потоки для декодирования/ресемплинга
+AIO_DOWNLOAD_TIMEOUT_SECONDS = float(os.getenv('AIO_DOWNLOAD_TIMEOUT_SECONDS', '300'))
+MINIO_PRESIGNED_URL_EXPIRY = timedelta(minutes=10)
+
+
+def _release_abandoned_decode_budget(decode_future: asyncio.Future):
+    """Освобождает бюджет декодирования, результат которого так и не был получен запросом."""
+    if not decode_future.cancelled() and decode_future.exception() is None:
+        DECODED_AUDIO_BUDGET.release(decode_future.result()[1])
+
+
+class AsyncAudioAnalysisServicer(AudioAnalysisServicer):
+    """
+    Асинхронный вариант сервиса для grpc.aio.
+    I/O (MinIO, Redis) выполняется в event loop, а декодирование и инференс
+    вынесены в отдельные ограниченные пулы потоков (пул инференса создает базовый класс, см. runtime_config).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.decode_executor = futures.ThreadPoolExecutor(max_workers=AIO_DECODE_WORKERS, thread_name_prefix='decode')
+        self.http_session: Optional[aiohttp.ClientSession] = None
+        self.async_redis_client: Optional[aioredis.Redis] = None
+        self.chunk_score_store_async = None
+        self.single_flight_async = AsyncSingleFlight()
+
+    def _init_redis_clients(self):
+        """
+        Синхронный Redis асинхронному сервису не нужен: его клиенты (redis.asyncio) создает start() внутри event loop,
+        а блокирующее подключение и ping() здесь выполнялись бы в потоке event loop.
+        """
+        self.redis_client = None
+        self.chunk_score_store = None
+
+    async def start(self):
+        """Создает асинхронные клиенты. Вызывается внутри работающего event loop."""
+        self.http_session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=AIO_DOWNLOAD_TIMEOUT_SECONDS))
+        # Redis нужен чекпоинтам независимо от стейджинга: иначе посчитанные чанки пропадут вместе с процессом
+        logger.info(f"Подключение к Redis (asyncio): {REDIS_HOST}:{REDIS_PORT}")
+        try:
+            self.async_redis_client = aioredis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0)
+            await self.async_redis_client.ping()
+            logger.info("Успешно подключено к Redis (asyncio).")
+        except aioredis.ConnectionError as e:
+            logger.error(f"Ошибка подключения к Redis (asyncio): {e}")
+            self.async_redis_client = None
+        if not REDIS_STAGING_ENABLED:
+            logger.info("Redis-стейджинг чанков отключен (REDIS_STAGING_ENABLED=false).")
+        # Хранилище посчитанных score чанков для возобновления анализа после сбоя
+        self.chunk_score_store_async = create_async_chunk_score_store(self.async_redis_client)
+
+    async def close(self):
+        """Закрывает асинхронные клиенты и пулы потоков."""
+        if self.http_session is not None:
+            await self.http_session.close()
+        if self.async_redis_client is not None:
+            await self.async_redis_client.close()
+        self.decode_executor.shutdown(wait=True)
+        self.inference_scheduler.shutdown(wait=True)
+        self.model_registry.stop_watching()
+        if self.shadow_logger is not None:
+            self.shadow_logger.close()
+        if self.feature_store is not None:
+            self.feature_store.close()
+
+    def _warm_up_once(self, timer: PhaseTimer) -> bool:
+        """Как у синхронного сервиса, плюс заранее поднимает потоки пула декодирования."""
+        return run_warmup(self._predict_all_models, self.device, timer,
+                          executors=[self.decode_executor], inference_executor=self.inference_executor)
+
+    async def _download_audio(self, bucket_name: str, object_key: str) -> Tuple[Optional[bytes], Optional[str], Optional[grpc.StatusCode], Optional[str]]:
+        """
+        Скачивает объект из MinIO без блокировки event loop.
+        Возвращает (bytes, etag, None, None) или (None, None, код_ошибки, сообщение).
+        """
+        # Подпись URL считается локально (регион задан явно), сетевой запрос идет через aiohttp
+        url = self.minio_client.presigned_get_object(bucket_name, object_key, expires=MINIO_PRESIGNED_URL_EXPIRY)
+        try:
+            async with self.http_session.get(url) as response:
+                if response.status == 404:
+                    body = await response.text()
+                    error_msg = f"Ошибка MinIO: объект '{object_key}' или бакет '{bucket_name}' не найден. Ответ: {body}"
+                    return None, None, grpc.StatusCode.NOT_FOUND, error_msg
+                if response.status != 200:
+                    body = await response.text()
+                    error_msg = f"Ошибка MinIO при скачивании файла '{object_key}' из бакета '{bucket_name}': HTTP {response.status}: {body}"
+                    return None, None, grpc.StatusCode.INTERNAL, error_msg
+                return await response.read(), response.headers.get('ETag'), None, None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error_msg = f"Неожиданная ошибка при скачивании файла из MinIO '{object_key}': {e!r}"
+            return None, None, grpc.StatusCode.INTERNAL, error_msg
+
+    def _decode_to_buffer(self, audio_content_bytes: bytes) -> Tuple[Optional[torch.Tensor], int, Optional[grpc.StatusCode], Optional[str]]:
+        """
+        CPU-часть: декодирование, моно, ресемплинг и раскладка в буфер чанков. Выполняется в decode_executor.
+        Возвращает (буфер [num_chunks, NUM_SAMPLES], зарезервированный_бюджет, код_ошибки, сообщение);
+        бюджет освобождает вызывающий.
+        """
+        decoded_budget_bytes = reserve_decoding_budget(audio_content_bytes)
+        try:
+            chunk_buffer, total_samples, loading_attempt_errors = decode_to_chunk_buffer(audio_content_bytes, pin_memory=self.device.type == "cuda")
+        except Exception:
+            DECODED_AUDIO_BUDGET.release(decoded_budget_bytes)
+            raise
+        if chunk_buffer is None:
+            return None, decoded_budget_bytes, grpc.StatusCode.INVALID_ARGUMENT, format_decode_error(loading_attempt_errors)
+        if total_samples == 0:
+            return None, decoded_budget_bytes, grpc.StatusCode.INVALID_ARGUMENT, "Аудиофайл пуст или не содержит аудиоданных после предобработки."
+
+        logger.info(f"Аудиофайл предобработан. Всего семплов: {total_samples}, будет чанков: {chunk_buffer.shape[0]}")
+        return chunk_buffer, DECODED_AUDIO_BUDGET.resize(decoded_budget_bytes, chunk_buffer.nbytes), None, None
+
+    async def _decode_in_executor(self, audio_content_bytes: bytes) -> Tuple[Optional[torch.Tensor], int, Optional[grpc.StatusCode], Optional[str]]:
+        """
+        _decode_to_buffer в decode_executor. Бюджет резервируется в потоке декодирования, поэтому при отмене
+        запроса (клиент отключился, дедлайн) задача доводится до конца, а ее резерв освобождает колбэк.
+        """
+        decode_future = asyncio.get_running_loop().run_in_executor(self.decode_executor, self._decode_to_buffer, audio_content_bytes)
+        try:
+            # shield: отмена запроса не должна терять результат задачи вместе с зарезервированным бюджетом
+            return await asyncio.shield(decode_future)
+        except asyncio.CancelledError:
+            decode_future.add_done_callback(_release_abandoned_decode_budget)
+            raise
+
+    async def _stage_chunks(self, request_id: str, chunk_buffer: torch.Tensor, chunk_indices: List[int]) -> Optional[str]:
+        """Сохраняет строки буфера чанков в Redis одним pipeline. Возвращает сообщение об ошибке или None."""
+        try:
+            async with self.async_redis_client.pipeline(transaction=False) as pipe:
+                for chunk_idx in chunk_indices:
+                    pipe.set(f"{request_id}:chunk_{chunk_idx}", chunk_buffer[chunk_idx].numpy().tobytes(), ex=REDIS_CHUNK_EXPIRY_SECONDS)
+                await pipe.execute()
+            return None
+        except aioredis.RedisError as e:
+            return f"Ошибка сохранения чанков в Redis: {e}"
+
+    async def _unstage_chunks(self, request_id: str, chunk_indices: List[int]):
+        """Удаляет из Redis чанки уже обработанного окна."""
+        try:
+            await self.async_redis_client.delete(*(f"{request_id}:chunk_{chunk_idx}" for chunk_idx in chunk_indices))
+        except aioredis.RedisError as e:
+            logger.warning(f"Error deleting chunks of request {request_id} from Redis: {e}")
+
+    async def _score_batch(self, request_id: str, chunk_indices: List[int], batch_tensor: torch.Tensor, model_entry: ModelEntry,
+                           priority: int, deadline: Optional[float],
+                           shadow_entry: Optional[ModelEntry] = None,
+                           extra_entries: Sequence[ModelEntry] = ()) -> List[Tuple[int, Optional[audio_analyzer_pb2.AudioChunkPrediction], Optional[str]]]:
+        """
+        Считает батч через inference_scheduler. При включенном стейджинге чанки читаются из Redis (MGET),
+        иначе модель получает срез буфера batch_tensor без копирования.
+        DeadlineExpired пробрасывается: батч снят с очереди, а не упал.
+        """
+        try:
+            results = []
+            if REDIS_STAGING_ENABLED:
+                payloads = await self.async_redis_client.mget([f"{request_id}:chunk_{chunk_idx}" for chunk_idx in chunk_indices])
+                chunk_indices, batch_tensor, results = self._batch_from_redis_payloads(request_id, chunk_indices, payloads)
+            if batch_tensor is not None:
+                # Отмена ожидания (клиент отключился) отменяет и батч, если он еще в очереди
+                results.extend(await asyncio.wrap_future(self.inference_scheduler.submit(
+                    priority, deadline, self._score_chunk_batch, chunk_indices, batch_tensor, request_id, model_entry, shadow_entry, extra_entries)))
+            return results
+        except DeadlineExpired:
+            raise
+        except Exception as e:
+            error_msg = f"Error processing chunks {chunk_indices[0]}-{chunk_indices[-1]} of request {request_id}: {e}"
+            logger.error(error_msg, exc_info=True)
+            return [(chunk_idx, None, error_msg) for chunk_idx in chunk_indices]
+
+    async def _object_etag_matches_async(self, request: audio_analyzer_pb2.AnalyzeAudioRequest, leader_etag: Optional[str]) -> bool:
+        """Асинхронный аналог _object_etag_matches: текущий ETag берется HEAD-запросом по presigned URL."""
+        if not leader_etag:
+            return False
+        try:
+            url = self.minio_client.get_presigned_url("HEAD", request.minio_bucket_name, request.minio_object_key, expires=MINIO_PRESIGNED_URL_EXPIRY)
+            async with self.http_session.head(url) as response:
+                etag = response.headers.get('ETag') if response.status == 200 else None
+        except Exception as e:
+            # Ошибка подписи URL или HEAD-запроса: чужой результат не принимается
+            logger.debug(f"HEAD для проверки single-flight не удался: {e!r}")
+            return False
+        return bool(etag) and etag.strip('"') == leader_etag
+
+    async def AnalyzeAudio(self, request: audio_analyzer_pb2.AnalyzeAudioRequest, context) -> audio_analyzer_pb2.AnalyzeAudioResponse:
+        """
+        Точка входа RPC: как у синхронного сервиса, одинаковые одновременные запросы склеиваются
+        (с досчетом по своему дедлайну и проверкой, что объект не изменился).
+        """
+        flight_key = self._single_flight_key(request)
+        if flight_key is None:
+            return await self._analyze_audio_async(request, context)
+        deadline = request_deadline(context)
+
+        async def _run_analysis():
+            recording_context = RecordingContext(context)
+            return await self._analyze_audio_async(request, recording_context, recording_context.record_object_etag), recording_context
+
+        while True:
+            try:
+                (response, recording_context), shared = await self.single_flight_async.do(flight_key, _run_analysis, timeout=grpc_time_remaining(context))
+            except asyncio.TimeoutError:
+                error_msg = f"Истекло время ожидания общего анализа {flight_key[0]}/{flight_key[1]}"
+                context.set_code(grpc.StatusCode.DEADLINE_EXCEEDED)
+                context.set_details(error_msg)
+                return audio_analyzer_pb2.AnalyzeAudioResponse(error_message=error_msg)
+            if not (shared and recording_context.code == grpc.StatusCode.DEADLINE_EXCEEDED and not deadline_passed(deadline)):
+                break
+            # Истек дедлайн запроса-инициатора, а не этого: повторы ожидавших запросов склеиваются между собой
+            logger.info(f"Общий анализ {flight_key[0]}/{flight_key[1]} прерван по чужому дедлайну, повтор через single-flight")
+            SINGLE_FLIGHT_REQUESTS.labels(role='rerun').inc()
+        if shared and not await self._object_etag_matches_async(request, recording_context.object_etag):
+            logger.info(f"Объект {flight_key[0]}/{flight_key[1]} изменился после скачивания общим анализом, анализ без склейки")
+            SINGLE_FLIGHT_REQUESTS.labels(role='stale').inc()
+            return await self._analyze_audio_async(request, context)
+        if shared:
+            logger.info(f"Запрос {flight_key[0]}/{flight_key[1]} склеен с уже выполняющимся анализом")
+            recording_context.replay(context)
+        SINGLE_FLIGHT_REQUESTS.labels(role='coalesced' if shared else 'leader').inc()
+        return response
+
+    async def _analyze_audio_async(self, request: audio_analyzer_pb2.AnalyzeAudioRequest, context,
+                                   on_object_etag: Optional[Callable[[Optional[str]], None]] = None) -> audio_analyzer_pb2.AnalyzeAudioResponse:
+        """Асинхронная версия _analyze_audio с тем же контрактом ответа, что и у синхронного сервиса."""
+        internal_request_id_for_redis = str(uuid.uuid4())
+        logger.info(f"Получен запрос AnalyzeAudio (aio). Bucket: '{request.minio_bucket_name}', Key: '{request.minio_object_key}'. Internal Redis ID: {internal_request_id_for_redis}")
+
+        def _error(code: grpc.StatusCode, error_msg: str) -> audio_analyzer_pb2.AnalyzeAudioResponse:
+            logger.error(error_msg)
+            context.set_code(code)
+            context.set_details(error_msg)
+            return audio_analyzer_pb2.AnalyzeAudioResponse(error_message=error_msg)
+
+        if REDIS_STAGING_ENABLED and self.async_redis_client is None:
+            return _error(grpc.StatusCode.UNAVAILABLE, "Ошибка сервера: Redis недоступен.")
+        if not request.minio_bucket_name or not request.minio_object_key:
+            return _error(grpc.StatusCode.INVALID_ARGUMENT, "Ошибка запроса: minio_bucket_name или minio_object_key не указаны.")
+        # Снимок реестра фиксируется на весь запрос: замена чекпоинта на лету его не затронет
+        model_snapshot = self.model_registry.snapshot()
+        model_entry, extra_entries, error_msg = self._resolve_request_models(model_snapshot, request)
+        if model_entry is None:
+            return _error(grpc.StatusCode.INVALID_ARGUMENT, error_msg)
+        shadow_entry = self._shadow_entry_for(model_snapshot, model_entry)
+        priority = request.priority
+        deadline = request_deadline(context)
+        deadline_expired = False
+
+        decoded_budget_bytes = 0
+        try:
+            # 1. Скачивание (не занимает поток)
+            audio_content_bytes, object_etag, error_code, error_msg = await self._download_audio(request.minio_bucket_name, request.minio_object_key)
+            if error_code is not None:
+                return _error(error_code, error_msg)
+            if on_object_etag is not None:
+                on_object_etag(object_etag)
+            if not audio_content_bytes:
+                return _error(grpc.StatusCode.INTERNAL, f"Файл '{request.minio_object_key}' из MinIO (бакет '{request.minio_bucket_name}') пуст или не удалось прочитать.")
+            logger.info(f"Файл из MinIO успешно загружен, размер: {len(audio_content_bytes)} байт.")
+
+            # 2. Декодирование в буфер чанков в отдельном пуле (там же ожидание бюджета декодированного аудио)
+            chunk_buffer, decoded_budget_bytes, error_code, error_msg = await self._decode_in_executor(audio_content_bytes)
+            del audio_content_bytes # Исходные байты больше не нужны
+            if error_code is not None:
+                return _error(error_code, error_msg)
+            num_chunks = chunk_buffer.shape[0]
+
+            # 3. Чекпоинт: чанки, посчитанные прошлыми попытками для этого же файла (ETag), не пересчитываются
+            # Чекпоинт ведется отдельно для каждой модели запроса; чанк пересчитывается, если его нет хотя бы у одной
+            job_keys = self._job_keys([model_entry, *extra_entries], request, object_etag)
+            stored_scores = await asyncio.gather(*(self.chunk_score_store_async.load(job_key) for _, job_key in job_keys))
+            if shadow_entry is not None:
+                self.shadow_logger.log_request(internal_request_id_for_redis, request.minio_bucket_name, request.minio_object_key, object_etag)
+            if self.feature_store is not None:
+                self.feature_store.log_request(internal_request_id_for_redis, request.minio_bucket_name, request.minio_object_key, object_etag)
+            results, pending_indices = self._resume_from_checkpoints(job_keys, stored_scores, num_chunks)
+            if results:
+                logger.info(f"Возобновление анализа {job_keys[0][1]}: {len(results)} из {num_chunks} чанков взяты из чекпоинта")
+
+            # 4. Окнами по CHECKPOINT_WINDOW_CHUNKS: стейджинг (опционально) и инференс батчами
+            # по INFERENCE_BATCH_SIZE; параллелизм ограничен размером inference_executor, порядок задает inference_scheduler
+            for window_start in range(0, len(pending_indices), CHECKPOINT_WINDOW_CHUNKS):
+                if deadline_expired or deadline_passed(deadline):
+                    deadline_expired = True
+                    break
+                window_indices = pending_indices[window_start:window_start + CHECKPOINT_WINDOW_CHUNKS]
+                if REDIS_STAGING_ENABLED:
+                    error_msg = await self._stage_chunks(internal_request_id_for_redis, chunk_buffer, window_indices)
+                    if error_msg:
+                        return _error(grpc.StatusCode.INTERNAL, error_msg)
+
+                batch_tasks = [
+                    asyncio.ensure_future(self._score_batch(internal_request_id_for_redis, batch_indices, batch_tensor, model_entry, priority, deadline, shadow_entry, extra_entries))
+                    for batch_indices, batch_tensor in iter_chunk_batches(chunk_buffer, window_indices, INFERENCE_BATCH_SIZE)
+                ]
+                try:
+                    # Каждый батч попадает в чекпоинт сразу по готовности (один pipeline на батч), а не после всего окна
+                    for next_batch in asyncio.as_completed(batch_tasks):
+                        try:
+                            batch_result = await next_batch
+                        except DeadlineExpired:
+                            deadline_expired = True
+                            continue
+                        results.extend(batch_result)
+                        for job_key, batch_scores in self._checkpoint_updates(job_keys, batch_result).items():
+                            await self.chunk_score_store_async.save_many(job_key, batch_scores)
+                finally:
+                    for task in batch_tasks:
+                        task.cancel() # Уже завершенные не затрагиваются; при отмене запроса снимаются батчи в очереди
+                if REDIS_STAGING_ENABLED:
+                    await self._unstage_chunks(internal_request_id_for_redis, window_indices)
+
+            if deadline_expired:
+                error_msg = (f"Дедлайн запроса истек: посчитано {len(results)} из {num_chunks} чанков "
+                             f"({PRIORITY_LABELS.get(priority, priority)}).")
+                if job_keys:
+                    error_msg += " Посчитанные чанки сохранены в чекпоинт, повторный запрос продолжит с них."
+                return _error(grpc.StatusCode.DEADLINE_EXCEEDED, error_msg)
+
+            predictions_list = [pred_obj for _, pred_obj, _ in results if pred_obj]
+            overall_error_message_parts = []
+            for _, _, err_str in results:
+                if err_str and err_str not in overall_error_message_parts:
+                    overall_error_message_parts.append(err_str)
+            predictions_list.sort(key=lambda p: p.start_time_seconds)
+
+            final_error_msg = " | ".join(overall_error_message_parts)
+            if final_error_msg and not predictions_list:
+                return _error(grpc.StatusCode.INTERNAL, final_error_msg)
+
+            logger.info(f"Анализ завершен для {internal_request_id_for_redis} ({model_entry.versioned_name}). Предсказаний: {len(predictions_list)}. Ошибки: '{final_error_msg if final_error_msg else 'Нет'}'")
+            return audio_analyzer_pb2.AnalyzeAudioResponse(predictions=predictions_list, error_message=final_error_msg, model_name=model_entry.versioned_name)
+
+        except Exception as e:
+            logger.error("Критическая ошибка в AnalyzeAudio (aio)", exc_info=True)
+            return _error(grpc.StatusCode.INTERNAL, f"Критическая ошибка в AnalyzeAudio: {e}")
+        finally:
+            DECODED_AUDIO_BUDGET.release(decoded_budget_bytes)
+
+
+async def serve_async():
+    """Запускает grpc.aio сервер и корректно останавливает его по SIGTERM/SIGINT."""
+    timer = PhaseTimer()
+    try:
+        logger.info("Попытка инициализации AsyncAudioAnalysisServicer...")
+        with timer.measure("init_servicer"):
+            servicer_instance = AsyncAudioAnalysisServicer()
+            await servicer_instance.start()
+        logger.info("AsyncAudioAnalysisServicer успешно инициализирован.")
+    except Exception as e:
+        logger.critical(f"КРИТИЧЕСКАЯ ОШИБКА при инициализации AsyncAudioAnalysisServicer: {e}", exc_info=True)
+        print("Сервер НЕ БУДЕТ ЗАПУЩЕН.")
+        return
+
+    server = grpc.aio.server(maximum_concurrent_rpcs=AIO_MAX_CONCURRENT_RPCS)
+    audio_analyzer_pb2_grpc.add_AudioAnalysisServicer_to_server(servicer_instance, server)
+    # Health checking: до окончания прогрева сервис отвечает NOT_SERVING
+    health_servicer = health.aio.HealthServicer()
+    health_pb2_grpc.add_HealthServicer_to_server(health_servicer, server)
+    for service_name in ("", SERVICE_FULL_NAME):
+        await health_servicer.set(service_name, health_pb2.HealthCheckResponse.NOT_SERVING)
+    server.add_insecure_port(_SERVER_ADDRESS)
+    with timer.measure("server_start"):
+        await server.start()
+    logger.info(f"Сервер gRPC (aio) слушает на {_SERVER_ADDRESS}, max_concurrent_rpcs={AIO_MAX_CONCURRENT_RPCS}")
+    start_metrics_server()
+
+    # Прогрев блокирующий, поэтому в отдельном потоке: health-проверки продолжают обслуживаться
+    loop = asyncio.get_running_loop()
+    stop_event = asyncio.Event()
+    if await loop.run_in_executor(None, servicer_instance.warm_up, timer):
+        for service_name in ("", SERVICE_FULL_NAME):
+            await health_servicer.set(service_name, health_pb2.HealthCheckResponse.SERVING)
+        timer.log_summary()
+        logger.info("Прогрев завершен, сервис объявлен готовым (SERVING).")
+    else:
+        # Непрогретый сервер не объявляется готовым: останавливаемся, чтобы оркестратор перезапустил процесс
+        logger.critical("Прогрев не удался, сервис остается NOT_SERVING. Остановка сервера.")
+        stop_event.set()
+
+    for sig in (signal_module.SIGTERM, signal_module.SIGINT):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    await stop_event.wait()
+    # Новые RPC отклоняются сразу, текущие получают GRPC_SHUTDOWN_GRACE_SECONDS на завершение
+    logger.info(f"Получен сигнал остановки. Дренирование запросов (grace={GRPC_SHUTDOWN_GRACE_SECONDS} с)...")
+    await health_servicer.enter_graceful_shutdown()
+    await server.stop(grace=GRPC_SHUTDOWN_GRACE_SECONDS)
+    await servicer_instance.close()
+    logger.info("Сервер gRPC (aio) полностью остановлен.")
+
+
+if __name__ == '__main__':
+    log_level_str = configure_logging()
+    logger.info(f"Запуск gRPC (aio) сервера из __main__ с уровнем логирования {log_level_str}...")
+    asyncio.run(serve_async())
@@ -7,6 +7,8 @@ import os
 import numpy as np
 import io # Для работы с байтами
 import logging # Для логирования
+from functools import lru_cache
+from typing import List, Optional, Tuple
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -16,6 +18,10 @@ MODEL_CHECKPOINT = "microsoft/wavlm-base"
 SAMPLE_RATE = 16000
 NUM_SAMPLES = 4 * SAMPLE_RATE # 64000 samples (4 seconds)
 CHECKPOINT_FILE = "chk3.pth" # Ожидается в той же директории
+INFERENCE_BATCH_SIZE = int(os.getenv('INFERENCE_BATCH_SIZE', '4')) # Чанков в одном forward модели
+# Точность инференса: fp32 | bf16_autocast (веса fp32, вычисления энкодера в bf16) | bf16 (веса энкодера в bf16)
+INFERENCE_PRECISION = os.getenv('INFERENCE_PRECISION', 'fp32').lower()
+PRECISIONS = ("fp32", "bf16_autocast", "bf16")
 
 # --- Класс модели (без изменений) ---
 class CustomWavLMForClassification(nn.Module):
@@ -33,17 +39,24 @@ class CustomWavLMForClassification(nn.Module):
         self.pool = nn.AdaptiveAvgPool1d(self.pool_output_size)
         self.linear = nn.Linear(self.hidden_size * self.pool_output_size, 1)
 
-    def forward(self, waveforms):
-        target_device = next(self.parameters()).device
-        waveforms = waveforms.to(target_device)
+    def encode(self, waveforms):
+        """Энкодер + пулинг: [B, num_samples] -> [B, hidden_size, pool_output_size]."""
+        target_param = next(self.wavlm.parameters())
+        waveforms = waveforms.to(device=target_param.device, dtype=target_param.dtype)
         outputs = self.wavlm(input_values=waveforms)
         features = outputs.last_hidden_state
         x = features.transpose(1, 2)
-        x = self.pool(x)
-        x = x.reshape(x.shape[0], -1)
+        return self.pool(x)
+
+    def classify(self, pooled):
+        """Классификационная голова: [B, hidden_size, pool_output_size] -> логиты [B]."""
+        x = pooled.reshape(pooled.shape[0], -1)
         x = self.linear(x)
         return x.squeeze(-1)
 
+    def forward(self, waveforms):
+        return self.classify(self.encode(waveforms))
+
 # --- Функция предобработки аудио (принимает байты) ---
 def preprocess_audio_bytes(audio_bytes: bytes, target_sr: int = SAMPLE_RATE, num_samples: int = NUM_SAMPLES):
     """Загружает из байтов, ресемплирует, конвертирует в моно и обрезает/дополняет аудио."""
@@ -80,6 +93,101 @@ def preprocess_audio_bytes(audio_bytes: bytes, target_sr: int = SAMPLE_RATE, num
         logging.error(f"Ошибка обработки аудио байтов: {e}", exc_info=True) # Логируем traceback
         return None
 
+# --- Декодирование полного файла (используется gRPC серверами) ---
+SUPPORTED_AUDIO_FORMATS = ["wav", "mp3", "flac", "webm", "ogg"]
+
+def decode_audio_bytes(audio_bytes: bytes) -> Tuple[Optional[torch.Tensor], Optional[int], List[str]]:
+    """
+    Пробует декодировать байты в каждом из SUPPORTED_AUDIO_FORMATS по очереди.
+    Возвращает (signal, sr, []) при успехе или (None, None, ошибки_попыток) при неудаче.
+    """
+    loading_attempt_errors = []
+    for format_to_try in SUPPORTED_AUDIO_FORMATS:
+        # Создаем НОВЫЙ поток для КАЖДОЙ попытки формата
+        audio_stream_for_format = io.BytesIO(audio_bytes)
+        try:
+            signal, sr = torchaudio.load(audio_stream_for_format, format=format_to_try)
+            logging.info(f"Файл успешно загружен в формате: {format_to_try}")
+            return signal, sr, []
+        except Exception as e:
+            error_msg_format = f"Ошибка при попытке загрузки файла в формате {format_to_try}: {e}"
+            logging.info(error_msg_format)
+            loading_attempt_errors.append(error_msg_format)
+    return None, None, loading_attempt_errors
+
+def estimate_decoded_bytes(audio_bytes: bytes, target_sr: int = SAMPLE_RATE) -> Optional[int]:
+    """
+    Оценивает объем памяти (float32) под декодированный сигнал и его моно-версию на target_sr,
+    не декодируя файл. Возвращает None, если метаданные не удалось прочитать.
+    """
+    for format_to_try in SUPPORTED_AUDIO_FORMATS:
+        try:
+            info = torchaudio.info(io.BytesIO(audio_bytes), format=format_to_try)
+        except Exception:
+            continue
+        if info.num_frames <= 0 or info.sample_rate <= 0:
+            return None # Например, webm без длительности в заголовке
+        resampled_frames = -(-info.num_frames * target_sr // info.sample_rate) # Округление вверх
+        return 4 * (info.num_frames * info.num_channels + resampled_frames)
+    return None
+
+@lru_cache(maxsize=16)
+def get_resampler(orig_sr: int, target_sr: int = SAMPLE_RATE) -> torchaudio.transforms.Resample:
+    """Возвращает закэшированный Resample: ядро фильтра строится один раз на пару частот."""
+    return torchaudio.transforms.Resample(orig_sr, target_sr)
+
+def to_chunk_buffer(signal: torch.Tensor, sr: int, target_sr: int = SAMPLE_RATE,
+                    num_samples: int = NUM_SAMPLES, pin_memory: bool = False) -> Tuple[torch.Tensor, int]:
+    """
+    Сводит в моно, ресемплирует и раскладывает сигнал [C, T] в один непрерывный float32 буфер,
+    дополненный нулями до кратного num_samples. Возвращает (buffer [num_chunks, num_samples], total_samples).
+    Строки буфера - готовые чанки; срез buffer[i:i + B] отдается модели без копирования.
+    """
+    channels = signal.shape[0]
+    if sr != target_sr:
+        # Моно до ресемплинга: ресемплинг линеен, а считать его на одном канале в C раз дешевле
+        source = signal.mean(dim=0) if channels > 1 else signal[0]
+        source = get_resampler(sr, target_sr)(source)
+        channels = 1
+    else:
+        source = signal
+    total_samples = source.shape[-1]
+    num_chunks = -(-total_samples // num_samples) # Округление вверх
+
+    buffer = torch.empty(num_chunks * num_samples, dtype=torch.float32, pin_memory=pin_memory)
+    if source.dim() == 1:
+        buffer[:total_samples].copy_(source)
+    elif channels > 1:
+        torch.mean(source, dim=0, out=buffer[:total_samples])
+    else:
+        buffer[:total_samples].copy_(source[0])
+    buffer[total_samples:].zero_()
+    return buffer.view(num_chunks, num_samples), total_samples
+
+def decode_to_chunk_buffer(audio_bytes: bytes, pin_memory: bool = False) -> Tuple[Optional[torch.Tensor], int, List[str]]:
+    """
+    Декодирует байты сразу в буфер чанков (см. to_chunk_buffer); декодированный сигнал
+    освобождается сразу после заполнения буфера. Возвращает (buffer, total_samples, ошибки_попыток).
+    """
+    signal, sr, loading_attempt_errors = decode_audio_bytes(audio_bytes)
+    if signal is None:
+        return None, 0, loading_attempt_errors
+    buffer, total_samples = to_chunk_buffer(signal, sr, pin_memory=pin_memory)
+    return buffer, total_samples, []
+
+def iter_chunk_batches(buffer: torch.Tensor, chunk_indices: List[int], batch_size: int):
+    """
+    Отдает (номера_чанков, тензор [B, num_samples]) батчами по batch_size.
+    Подряд идущие номера отдаются срезом буфера без копирования; разрывы (после чекпоинта) - через index_select.
+    """
+    for start in range(0, len(chunk_indices), batch_size):
+        batch_indices = chunk_indices[start:start + batch_size]
+        first, last = batch_indices[0], batch_indices[-1]
+        if last - first + 1 == len(batch_indices):
+            yield batch_indices, buffer[first:last + 1]
+        else:
+            yield batch_indices, buffer.index_select(0, torch.tensor(batch_indices))
+
 # --- Функция загрузки модели (без изменений, кроме print -> logging) ---
 def load_model_from_checkpoint(checkpoint_path: str, device: torch.device):
     """Инициализирует модель и загружает веса из файла чекпоинта."""
@@ -89,18 +197,9 @@ def load_model_from_checkpoint(checkpoint_path: str, device: torch.device):
 
     model = CustomWavLMForClassification(checkpoint=MODEL_CHECKPOINT)
     try:
-        logging.info(f"Загрузка чекпоинта из: {checkpoint_path}...")
-        checkpoint = torch.load(checkpoint_path, map_location=device, weights_only=False)
-
-        if 'model_state_dict' in checkpoint:
-            model_state_dict = checkpoint['model_state_dict']
-            logging.info("Найден 'model_state_dict' в чекпоинте.")
-        elif isinstance(checkpoint, dict):
-            model_state_dict = checkpoint
-            logging.warning("Используется весь словарь чекпоинта как state_dict.")
-        else:
-             logging.error("Не удалось определить state_dict в чекпоинте.")
-             return None
+        model_state_dict = load_checkpoint_state_dict(checkpoint_path, device)
+        if model_state_dict is None:
+            return None
 
         model.load_state_dict(model_state_dict)
         logging.info("Веса модели успешно загружены.")
@@ -113,6 +212,86 @@ def load_model_from_checkpoint(checkpoint_path: str, device: torch.device):
         logging.error(f"Ошибка при загрузке модели из {checkpoint_path}: {e}", exc_info=True)
         return None
 
+def load_checkpoint_state_dict(checkpoint_path: str, device: torch.device) -> Optional[dict]:
+    """Читает state_dict модели из файла чекпоинта (с 'model_state_dict' или без обертки)."""
+    logging.info(f"Загрузка чекпоинта из: {checkpoint_path}...")
+    checkpoint = torch.load(checkpoint_path, map_location=device, weights_only=False)
+
+    if 'model_state_dict' in checkpoint:
+        logging.info("Найден 'model_state_dict' в чекпоинте.")
+        return checkpoint['model_state_dict']
+    elif isinstance(checkpoint, dict):
+        logging.warning("Используется весь словарь чекпоинта как state_dict.")
+        return checkpoint
+    logging.error("Не удалось определить state_dict в чекпоинте.")
+    return None
+
+# --- Смешанная точность (bfloat16) ---
+def cpu_flags() -> set:
+    """Флаги CPU из /proc/cpuinfo (Linux); пустое множество, если их не прочитать."""
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("flags"):
+                    return set(line.split(":", 1)[1].split())
+    except OSError:
+        pass
+    return set()
+
+def cpu_supports_bf16() -> bool:
+    """
+    Есть ли у CPU нативная поддержка bf16 (AVX-512 BF16 / AMX), которую использует oneDNN.
+    Проверка mkldnn сама по себе не подходит: она истинна на любом CPU с AVX-512 (Skylake, Cascade Lake),
+    где oneDNN только эмулирует bf16 и считает медленнее, чем в fp32.
+    """
+    if not cpu_flags() & {"avx512_bf16", "amx_bf16"}:
+        return False
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return True # Старый torch без этой проверки: решаем по флагам CPU
+
+def resolve_precision(requested: str, device: torch.device) -> str:
+    """Проверяет, что запрошенная точность поддерживается устройством; иначе откатывается на fp32."""
+    if requested not in PRECISIONS:
+        logging.warning(f"Неизвестная точность инференса '{requested}'. Используется fp32.")
+        return "fp32"
+    if requested == "fp32":
+        return requested
+    supported = torch.cuda.is_bf16_supported() if device.type == "cuda" else cpu_supports_bf16()
+    if not supported:
+        logging.warning(f"Устройство {device} не поддерживает bf16 нативно. Используется fp32.")
+        return "fp32"
+    return requested
+
+def apply_precision(model: nn.Module, precision: str) -> nn.Module:
+    """Для режима bf16 переводит веса энкодера в bfloat16. Голова (linear) всегда остается в fp32."""
+    if precision == "bf16":
+        model.wavlm.to(torch.bfloat16)
+    return model
+
+def encode_pooled(model: nn.Module, batch_tensor: torch.Tensor, precision: str = "fp32") -> torch.Tensor:
+    """Признаки энкодера после пулинга [B, hidden_size, pool_output_size] в fp32 с учетом точности."""
+    with torch.no_grad():
+        if precision == "fp32":
+            return model.encode(batch_tensor)
+        device_type = next(model.parameters()).device.type
+        with torch.autocast(device_type=device_type, dtype=torch.bfloat16):
+            pooled = model.encode(batch_tensor)
+        return pooled.float()
+
+def classify_pooled(head: nn.Linear, pooled: torch.Tensor) -> torch.Tensor:
+    """Логиты [B] головы head (linear из чекпоинта) на уже посчитанных признаках энкодера."""
+    with torch.no_grad():
+        return head(pooled.reshape(pooled.shape[0], -1)).squeeze(-1)
+
+def predict_logits(model: nn.Module, batch_tensor: torch.Tensor, precision: str = "fp32") -> torch.Tensor:
+    """
+    Логиты [B] в fp32 для батча [B, NUM_SAMPLES] с учетом точности.
+    Энкодер может считаться в bf16, а linear и сигмоида вызывающего - всегда в fp32.
+    """
+    return classify_pooled(model.linear, encode_pooled(model, batch_tensor, precision))
+
 # --- Функция для предсказания (принимает байты) ---
 def predict_audio_bytes(audio_bytes: bytes, model: nn.Module, device: torch.device):
     """Выполняет предобработку (из байтов) и предсказание."""
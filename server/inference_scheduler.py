@@ -0,0 +1,150 @@
+import math
+import time
+import heapq
+import itertools
+import threading
+import logging
+from concurrent import futures
+from contextlib import contextmanager
+from typing import Any, Callable, List, Optional
+
+from audio_analyzer_pb2 import PRIORITY_INTERACTIVE, PRIORITY_BULK
+from metrics import INFERENCE_BATCHES, INFERENCE_QUEUE_WAIT_SECONDS
+from single_flight import grpc_time_remaining
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_LABELS = {PRIORITY_INTERACTIVE: 'interactive', PRIORITY_BULK: 'bulk'}
+
+
+class DeadlineExpired(Exception):
+    """Батч снят с очереди: дедлайн запроса истек до начала его обработки."""
+
+
+def request_deadline(context) -> Optional[float]:
+    """Дедлайн запроса gRPC по часам time.monotonic(); None - клиент не задал дедлайн."""
+    remaining = grpc_time_remaining(context)
+    if remaining is None:
+        return None
+    return time.monotonic() + remaining
+
+
+def deadline_passed(deadline: Optional[float]) -> bool:
+    return deadline is not None and time.monotonic() >= deadline
+
+
+class _Task:
+    __slots__ = ('sort_key', 'priority', 'deadline', 'enqueued_at', 'future', 'fn', 'args')
+
+    def __init__(self, priority: int, deadline: Optional[float], seq: int, fn: Callable, args: tuple):
+        self.priority = priority
+        self.deadline = deadline
+        # Интерактивные раньше фоновых, внутри класса - ближайший дедлайн, затем порядок поступления
+        self.sort_key = (priority, deadline if deadline is not None else math.inf, seq)
+        self.enqueued_at = time.monotonic()
+        self.future = futures.Future()
+        self.fn = fn
+        self.args = args
+
+    def __lt__(self, other: "_Task") -> bool:
+        return self.sort_key < other.sort_key
+
+
+class InferenceScheduler:
+    """
+    Очередь с приоритетами перед пулом инференса. В пул одновременно передается не больше max_in_flight
+    батчей (по числу его потоков), остальные ждут здесь. Освободившийся поток берет самый приоритетный
+    батч, поэтому интерактивный запрос ждет не дольше одного уже начатого батча, а фоновая обработка
+    вытесняется на границах батчей. Батчи запросов с истекшим дедлайном не считаются:
+    их future завершается исключением DeadlineExpired.
+    """
+
+    def __init__(self, executor: futures.ThreadPoolExecutor, max_in_flight: int):
+        self._executor = executor
+        self._max_in_flight = max(1, max_in_flight)
+        self._lock = threading.Lock()
+        self._queue: List[_Task] = []
+        self._seq = itertools.count()
+        self._in_flight = 0
+        self._closed = False
+        self._paused = False
+
+    def submit(self, priority: int, deadline: Optional[float], fn: Callable, *args: Any) -> futures.Future:
+        """Ставит fn(*args) в очередь с классом priority и дедлайном deadline (time.monotonic())."""
+        if priority not in PRIORITY_LABELS:
+            priority = PRIORITY_INTERACTIVE # Неизвестное значение enum от нового клиента
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Планировщик инференса остановлен")
+            task = _Task(priority, deadline, next(self._seq), fn, args)
+            heapq.heappush(self._queue, task)
+        self._dispatch()
+        return task.future
+
+    def _dispatch(self):
+        """Передает в пул самые приоритетные батчи, пока есть свободные потоки."""
+        while True:
+            expired = []
+            with self._lock:
+                task = None
+                while self._queue and not self._paused and self._in_flight < self._max_in_flight:
+                    candidate = heapq.heappop(self._queue)
+                    if not candidate.future.set_running_or_notify_cancel():
+                        continue # Отменен ожидающим
+                    if deadline_passed(candidate.deadline):
+                        expired.append(candidate)
+                        continue
+                    task = candidate
+                    self._in_flight += 1
+                    break
+            # Future завершаются вне блокировки: их колбэки могут сразу ставить новые батчи
+            for expired_task in expired:
+                INFERENCE_BATCHES.labels(priority=PRIORITY_LABELS[expired_task.priority], outcome='expired').inc()
+                expired_task.future.set_exception(DeadlineExpired("Дедлайн запроса истек до начала инференса батча"))
+            if task is None:
+                return
+            INFERENCE_QUEUE_WAIT_SECONDS.labels(priority=PRIORITY_LABELS[task.priority]).observe(time.monotonic() - task.enqueued_at)
+            self._executor.submit(self._run, task)
+
+    def _run(self, task: _Task):
+        try:
+            result = task.fn(*task.args)
+        except BaseException as e:
+            task.future.set_exception(e)
+        else:
+            task.future.set_result(result)
+        finally:
+            INFERENCE_BATCHES.labels(priority=PRIORITY_LABELS[task.priority], outcome='done').inc()
+            with self._lock:
+                self._in_flight -= 1
+            self._dispatch()
+
+    @contextmanager
+    def paused(self):
+        """
+        На время блока батчи только копятся в очереди и не передаются в пул (например, пока прогрев
+        занимает все потоки пула); после блока очередь разбирается в обычном порядке.
+        """
+        with self._lock:
+            self._paused = True
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._paused = False
+            self._dispatch()
+
+    def queued(self) -> int:
+        with self._lock:
+            return len(self._queue)
+
+    def shutdown(self, wait: bool = True):
+        """Отменяет батчи в очереди и останавливает пул (уже начатые батчи дорабатывают)."""
+        with self._lock:
+            self._closed = True
+            pending, self._queue = self._queue, []
+        for task in pending:
+            task.future.cancel()
+        if pending:
+            logger.info(f"Планировщик инференса: отменено батчей в очереди: {len(pending)}")
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,35 @@
+import os
+import logging
+
+from prometheus_client import Counter, Histogram, start_http_server
+
+logger = logging.getLogger(__name__)
+
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0')) # Порт HTTP-эндпоинта Prometheus; 0 - не поднимать
+
+SINGLE_FLIGHT_REQUESTS = Counter(
+    'audio_analysis_single_flight_requests_total',
+    'Запросы AnalyzeAudio по роли в single-flight: leader - выполнил анализ, coalesced - получил чужой результат, '
+    'rerun - повтор общего анализа после истечения дедлайна инициатора, '
+    'stale - объект изменился после скачивания инициатором, анализ выполнен отдельно',
+    ['role'],
+)
+
+INFERENCE_BATCHES = Counter(
+    'audio_analysis_inference_batches_total',
+    'Батчи планировщика инференса по классу приоритета: done - посчитан, expired - снят по истекшему дедлайну',
+    ['priority', 'outcome'],
+)
+
+INFERENCE_QUEUE_WAIT_SECONDS = Histogram(
+    'audio_analysis_inference_queue_wait_seconds',
+    'Время ожидания батча в очереди планировщика до передачи в пул инференса',
+    ['priority'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300),
+)
+
+
+def start_metrics_server():
+    if METRICS_PORT > 0:
+        start_http_server(METRICS_PORT)
+        logger.info(f"Метрики Prometheus доступны на :{METRICS_PORT}/metrics")
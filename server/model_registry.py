@@ -0,0 +1,251 @@
+import os
+import json
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import torch
+from torch import nn
+
+from inference import (
+    CustomWavLMForClassification,
+    apply_precision,
+    classify_pooled,
+    encode_pooled,
+    load_checkpoint_state_dict,
+    CHECKPOINT_FILE,
+    MODEL_CHECKPOINT,
+    NUM_SAMPLES,
+)
+
+logger = logging.getLogger(__name__)
+
+# Модели реестра: "имя=путь,имя2=путь2" (пути относительно server/). Используется, если нет MODEL_REGISTRY_FILE
+MODEL_CHECKPOINTS = os.getenv('MODEL_CHECKPOINTS', f"default={CHECKPOINT_FILE}")
+DEFAULT_MODEL_NAME = os.getenv('DEFAULT_MODEL_NAME', 'default')
+# JSON-файл реестра {"default_model": "...", "models": {"имя": "путь"}}; перечитывается на лету
+MODEL_REGISTRY_FILE = os.getenv('MODEL_REGISTRY_FILE', '')
+MODEL_RELOAD_INTERVAL_SECONDS = float(os.getenv('MODEL_RELOAD_INTERVAL_SECONDS', '30')) # 0 = не следить за изменениями
+
+BACKBONE_PREFIX = "wavlm."
+HEAD_PREFIX = "linear."
+
+
+def read_model_config(base_dir: str) -> Tuple[Dict[str, str], str]:
+    """Возвращает ({имя: абсолютный_путь_чекпоинта}, имя_модели_по_умолчанию)."""
+    if MODEL_REGISTRY_FILE:
+        with open(MODEL_REGISTRY_FILE) as f:
+            config = json.load(f)
+        models = config.get("models", {})
+        default_name = config.get("default_model", DEFAULT_MODEL_NAME)
+    else:
+        models = dict(item.split('=', 1) for item in MODEL_CHECKPOINTS.split(',') if item.strip())
+        default_name = DEFAULT_MODEL_NAME
+    models = {name.strip(): os.path.join(base_dir, path.strip()) for name, path in models.items()}
+    if default_name not in models:
+        raise ValueError(f"Модель по умолчанию '{default_name}' отсутствует в реестре: {sorted(models)}")
+    return models, default_name
+
+
+def file_signature(path: str) -> Optional[Tuple[float, int]]:
+    """(mtime, размер) файла или None, если файла нет."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime, stat.st_size
+
+
+def tensors_fingerprint(state_dict: dict, prefix: str) -> str:
+    """SHA-1 по именам и содержимому тензоров с заданным префиксом."""
+    digest = hashlib.sha1()
+    for name in sorted(key for key in state_dict if key.startswith(prefix)):
+        tensor = state_dict[name].detach().cpu().contiguous().reshape(-1)
+        digest.update(name.encode())
+        digest.update(tensor.view(torch.uint8).numpy().tobytes())
+    return digest.hexdigest()
+
+
+class ModelEntry:
+    """Модель реестра: общий энкодер (backbone) и собственная классификационная голова из чекпоинта."""
+
+    def __init__(self, name: str, checkpoint_path: str, signature: Tuple[float, int],
+                 backbone_key: str, backbone: CustomWavLMForClassification, head: nn.Linear, revision: str):
+        self.name = name
+        self.checkpoint_path = checkpoint_path
+        self.signature = signature
+        self.backbone_key = backbone_key
+        self.backbone = backbone
+        self.head = head
+        self.revision = revision
+
+    @property
+    def versioned_name(self) -> str:
+        """Имя с ревизией весов: меняется при замене чекпоинта (ключи кэшей и ответы клиенту)."""
+        return f"{self.name}@{self.revision}"
+
+
+class ModelSnapshot:
+    """
+    Неизменяемый набор моделей. Запрос берет снимок один раз и работает с ним до конца,
+    поэтому замена реестра на лету не затрагивает запросы в обработке.
+    """
+
+    def __init__(self, entries: Dict[str, ModelEntry], default_name: str, precision: str):
+        self.entries = entries
+        self.default_name = default_name
+        self.precision = precision
+
+    def get(self, name: Optional[str]) -> Optional[ModelEntry]:
+        """Модель по имени; пустое имя - модель по умолчанию."""
+        return self.entries.get(name or self.default_name)
+
+    @property
+    def default(self) -> ModelEntry:
+        return self.entries[self.default_name]
+
+    def predict_logits(self, batch_tensor: torch.Tensor, entries: Iterable[ModelEntry],
+                       shadow_entries: Iterable[ModelEntry] = (),
+                       pooled_sink: Optional[Callable[[ModelEntry, torch.Tensor], None]] = None) -> Dict[str, torch.Tensor]:
+        """
+        Логиты [B] каждой из entries. Энкодер считается один раз на каждый общий backbone,
+        все головы этого backbone применяются к одним и тем же признакам.
+        shadow_entries считаются только на уже посчитанных признаках (без лишнего прогона энкодера),
+        а их ошибки логируются и не влияют на результат entries.
+        pooled_sink(первая_модель_backbone, признаки [B, H, P]) вызывается для каждого посчитанного backbone.
+        """
+        by_backbone: "OrderedDict[str, List[ModelEntry]]" = OrderedDict()
+        for entry in entries:
+            by_backbone.setdefault(entry.backbone_key, []).append(entry)
+        logits = {}
+        for backbone_key, backbone_entries in by_backbone.items():
+            pooled = encode_pooled(backbone_entries[0].backbone, batch_tensor, self.precision)
+            if pooled_sink is not None:
+                pooled_sink(backbone_entries[0], pooled)
+            for entry in backbone_entries:
+                logits[entry.name] = classify_pooled(entry.head, pooled)
+            for shadow_entry in shadow_entries:
+                if shadow_entry.backbone_key != backbone_key or shadow_entry.name in logits:
+                    continue
+                try:
+                    logits[shadow_entry.name] = classify_pooled(shadow_entry.head, pooled)
+                except Exception as e:
+                    logger.warning(f"Ошибка теневой модели '{shadow_entry.name}': {e}")
+        return logits
+
+
+class ModelRegistry:
+    """
+    Реестр моделей по имени. Чекпоинты с одинаковыми весами энкодера делят один backbone в памяти.
+    reload() собирает новый снимок (неизмененные чекпоинты и backbone переиспользуются) и атомарно
+    подменяет текущий; при ошибке продолжает работать прежний снимок.
+    """
+
+    def __init__(self, device: torch.device, precision: str, base_dir: str):
+        self.device = device
+        self.precision = precision
+        self.base_dir = base_dir
+        self._snapshot: Optional[ModelSnapshot] = None
+        self._config_signature = None
+        self._reload_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._watcher: Optional[threading.Thread] = None
+
+    def snapshot(self) -> ModelSnapshot:
+        return self._snapshot
+
+    def _current_config_signature(self, models: Dict[str, str]):
+        registry_file = file_signature(MODEL_REGISTRY_FILE) if MODEL_REGISTRY_FILE else None
+        return registry_file, tuple(sorted((name, path, file_signature(path)) for name, path in models.items()))
+
+    def _load_entry(self, name: str, path: str, backbones: Dict[str, CustomWavLMForClassification]) -> ModelEntry:
+        signature = file_signature(path)
+        if signature is None:
+            raise FileNotFoundError(f"Файл чекпоинта не найден: {path}")
+        state_dict = load_checkpoint_state_dict(path, torch.device("cpu"))
+        if state_dict is None:
+            raise ValueError(f"Не удалось определить state_dict в чекпоинте {path}")
+
+        backbone_key = tensors_fingerprint(state_dict, BACKBONE_PREFIX)
+        backbone = backbones.get(backbone_key)
+        if backbone is None:
+            logger.info(f"Модель '{name}': загрузка нового backbone {backbone_key[:12]}")
+            backbone = CustomWavLMForClassification(checkpoint=MODEL_CHECKPOINT)
+            backbone.load_state_dict(state_dict)
+            backbone.to(self.device)
+            backbone.eval()
+            apply_precision(backbone, self.precision)
+            backbones[backbone_key] = backbone
+        else:
+            logger.info(f"Модель '{name}': используется уже загруженный backbone {backbone_key[:12]}")
+
+        head = nn.Linear(backbone.hidden_size * backbone.pool_output_size, 1)
+        head.load_state_dict({key[len(HEAD_PREFIX):]: value for key, value in state_dict.items() if key.startswith(HEAD_PREFIX)})
+        head.to(self.device)
+        head.eval()
+        revision = hashlib.sha1((backbone_key + tensors_fingerprint(state_dict, HEAD_PREFIX)).encode()).hexdigest()[:12]
+        return ModelEntry(name, path, signature, backbone_key, backbone, head, revision)
+
+    def _warm_up_entries(self, entries: Iterable[ModelEntry]):
+        """
+        Пробный forward новых моделей до подмены снимка: первый прогон (выделение памяти, выбор ядер)
+        приходится на reload, а не на боевой запрос.
+        """
+        dummy = torch.zeros(1, NUM_SAMPLES, device=self.device)
+        by_backbone: Dict[str, List[ModelEntry]] = {}
+        for entry in entries:
+            by_backbone.setdefault(entry.backbone_key, []).append(entry)
+        for backbone_entries in by_backbone.values():
+            pooled = encode_pooled(backbone_entries[0].backbone, dummy, self.precision)
+            for entry in backbone_entries:
+                classify_pooled(entry.head, pooled)
+
+    def reload(self) -> bool:
+        """Перечитывает реестр. Возвращает True, если снимок был заменен."""
+        with self._reload_lock:
+            models, default_name = read_model_config(self.base_dir)
+            config_signature = self._current_config_signature(models)
+            previous = self._snapshot
+            if previous is not None and config_signature == self._config_signature:
+                return False
+
+            previous_entries = previous.entries if previous else {}
+            backbones = {entry.backbone_key: entry.backbone for entry in previous_entries.values()}
+            entries = {}
+            loaded = []
+            for name, path in models.items():
+                old_entry = previous_entries.get(name)
+                if old_entry is not None and old_entry.checkpoint_path == path and old_entry.signature == file_signature(path):
+                    entries[name] = old_entry
+                else:
+                    entries[name] = self._load_entry(name, path, backbones)
+                    loaded.append(entries[name])
+            # Ошибка прогрева, как и ошибка загрузки, оставляет в работе прежний снимок
+            self._warm_up_entries(loaded)
+
+            self._snapshot = ModelSnapshot(entries, default_name, self.precision)
+            self._config_signature = config_signature
+            num_backbones = len({entry.backbone_key for entry in entries.values()})
+            logger.info(f"Реестр моделей обновлен: {', '.join(e.versioned_name for e in entries.values())}; "
+                        f"по умолчанию '{default_name}', backbone в памяти: {num_backbones}")
+            return True
+
+    def _watch(self, interval_seconds: float):
+        while not self._stop_event.wait(interval_seconds):
+            try:
+                self.reload()
+            except Exception as e:
+                # Битый или недописанный чекпоинт: оставляем прежний снимок и пробуем на следующей итерации
+                logger.error(f"Ошибка перезагрузки реестра моделей, работает прежний набор: {e}", exc_info=True)
+
+    def start_watching(self, interval_seconds: float = MODEL_RELOAD_INTERVAL_SECONDS):
+        """Фоновая проверка изменений реестра и файлов чекпоинтов."""
+        if interval_seconds <= 0 or self._watcher is not None:
+            return
+        self._watcher = threading.Thread(target=self._watch, args=(interval_seconds,), name='model-registry-watcher', daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self):
+        self._stop_event.set()
@@ -0,0 +1,105 @@
+"""
+Пересчет score по сохраненным признакам энкодера (FEATURE_STORE_DIR) новой головой из чекпоинта,
+без повторного прогона WavLM. Подходит для чекпоинтов, у которых менялись только pool/linear:
+пространство признаков выбирается по отпечатку весов энкодера чекпоинта.
+
+Запуск из директории server/:
+    python rescore_features.py --store-dir /data/features --checkpoint chk4.pth --output scores.jsonl \
+        --objects-output objects.jsonl
+"""
+import argparse
+import json
+import os
+import time
+import logging
+
+import numpy as np
+import torch
+from torch import nn
+
+from inference import classify_pooled, load_checkpoint_state_dict, PRECISIONS
+from model_registry import tensors_fingerprint, BACKBONE_PREFIX, HEAD_PREFIX
+from feature_store import feature_space_name, iter_feature_shards, FEATURE_STORE_DIR, MANIFEST_FILE
+
+logger = logging.getLogger(__name__)
+
+
+def load_head(state_dict: dict, in_features: int, device: torch.device) -> nn.Linear:
+    """Голова (linear.*) чекпоинта без загрузки энкодера."""
+    head = nn.Linear(in_features, 1)
+    head.load_state_dict({key[len(HEAD_PREFIX):]: value for key, value in state_dict.items() if key.startswith(HEAD_PREFIX)})
+    return head.to(device).eval()
+
+
+def rescore_space(space_dir: str, state_dict: dict, batch_size: int, device: torch.device):
+    """Генератор (ключ_чанка, score) по всем шардам пространства."""
+    head = None
+    for keys, features in iter_feature_shards(space_dir):
+        if head is None:
+            head = load_head(state_dict, int(np.prod(features.shape[1:])), device)
+        for start in range(0, len(keys), batch_size):
+            # fp16 -> fp32 только для текущего батча; остальной шард остается на диске
+            pooled = torch.from_numpy(np.asarray(features[start:start + batch_size], dtype=np.float32)).to(device)
+            scores = torch.sigmoid(classify_pooled(head, pooled)).cpu().tolist()
+            yield from zip(keys[start:start + batch_size], scores)
+
+
+def write_object_scores(store_dir: str, space: str, scores_by_key: dict, output_path: str) -> int:
+    """Сводит score по ключам чанков обратно к объектам MinIO по манифесту хранилища."""
+    requests, written = {}, 0
+    with open(os.path.join(store_dir, MANIFEST_FILE), encoding='utf-8') as manifest, open(output_path, 'w', encoding='utf-8') as out:
+        for line in manifest:
+            record = json.loads(line)
+            if record["type"] == "request":
+                requests[record["request_id"]] = record
+                continue
+            if record["space"] != space or record["request_id"] not in requests:
+                continue
+            source = requests[record["request_id"]]
+            for chunk_idx, content_key in zip(record["chunks"], record["content_keys"]):
+                if content_key in scores_by_key:
+                    out.write(json.dumps({"bucket": source["bucket"], "key": source["key"], "etag": source["etag"],
+                                          "chunk_idx": chunk_idx, "score": round(scores_by_key[content_key], 4)}, ensure_ascii=False) + "\n")
+                    written += 1
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--store-dir', default=FEATURE_STORE_DIR, required=not FEATURE_STORE_DIR)
+    parser.add_argument('--checkpoint', required=True, help="Чекпоинт с новой головой")
+    parser.add_argument('--precision', default='fp32', choices=PRECISIONS, help="Точность, с которой сервер считал признаки")
+    parser.add_argument('--space', default=None, help="Каталог пространства признаков (по умолчанию - по отпечатку энкодера чекпоинта)")
+    parser.add_argument('--output', required=True, help="JSON Lines: content_key, score")
+    parser.add_argument('--objects-output', default=None, help="JSON Lines: bucket, key, etag, chunk_idx, score (по манифесту)")
+    parser.add_argument('--batch-size', type=int, default=4096)
+    args = parser.parse_args()
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    state_dict = load_checkpoint_state_dict(args.checkpoint, torch.device("cpu"))
+    if state_dict is None:
+        raise SystemExit(f"Не удалось прочитать state_dict из {args.checkpoint}")
+    space = args.space or feature_space_name(tensors_fingerprint(state_dict, BACKBONE_PREFIX), args.precision)
+    space_dir = os.path.join(args.store_dir, space)
+    if not os.path.isdir(space_dir):
+        available = sorted(d for d in os.listdir(args.store_dir) if os.path.isdir(os.path.join(args.store_dir, d)))
+        raise SystemExit(f"Нет признаков для энкодера этого чекпоинта ({space}). Доступные пространства: {available}")
+
+    started = time.perf_counter()
+    scores_by_key = {}
+    with open(args.output, 'w', encoding='utf-8') as out:
+        for content_key, score in rescore_space(space_dir, state_dict, args.batch_size, device):
+            if content_key in scores_by_key:
+                continue # Дубль чанка в другом шарде
+            scores_by_key[content_key] = score
+            out.write(json.dumps({"content_key": content_key, "score": round(score, 4)}) + "\n")
+    elapsed = time.perf_counter() - started
+    print(f"Пересчитано чанков: {len(scores_by_key)} за {elapsed:.2f} с ({space})")
+
+    if args.objects_output:
+        written = write_object_scores(args.store_dir, space, scores_by_key, args.objects_output)
+        print(f"Записано score по объектам: {written} -> {args.objects_output}")
+
+
+if __name__ == "__main__":
+    main()
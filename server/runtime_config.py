@@ -0,0 +1,131 @@
+import os
+import threading
+import logging
+from concurrent import futures
+from typing import List, Optional
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+# Параллельных forward модели (потоков пула инференса на весь процесс)
+INFERENCE_WORKERS = int(os.getenv('INFERENCE_WORKERS', str(min(8, os.cpu_count() or 4))))
+# Потоков intra-op на один forward; 0 = авто: доступные ядра / INFERENCE_WORKERS
+TORCH_INTRA_OP_THREADS = int(os.getenv('TORCH_INTRA_OP_THREADS', '0'))
+# Потоков inter-op (параллельные независимые операторы); модели они почти не нужны
+TORCH_INTEROP_THREADS = int(os.getenv('TORCH_INTEROP_THREADS', '1'))
+# Ограничение процесса набором ядер ("0-7,16-23") и/или NUMA-узлом (ядра узла берутся из sysfs)
+INFERENCE_CPU_AFFINITY = os.getenv('INFERENCE_CPU_AFFINITY', '')
+INFERENCE_NUMA_NODE = os.getenv('INFERENCE_NUMA_NODE', '')
+# Закреплять каждый поток пула инференса за своим непересекающимся набором ядер
+PIN_INFERENCE_WORKERS = os.getenv('PIN_INFERENCE_WORKERS', 'False').lower() == 'true'
+
+
+def parse_cpu_list(cpu_list: str) -> List[int]:
+    """Разбирает список ядер в формате sysfs/taskset: "0-3,8,10-11"."""
+    cpus = []
+    for part in cpu_list.strip().split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-', 1)
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return sorted(set(cpus))
+
+
+def numa_node_cpus(node: int) -> List[int]:
+    """Ядра NUMA-узла из /sys/devices/system/node/nodeN/cpulist."""
+    with open(f"/sys/devices/system/node/node{node}/cpulist") as f:
+        return parse_cpu_list(f.read())
+
+
+def available_cpus() -> List[int]:
+    """Ядра, на которых процессу разрешено выполняться."""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+class RuntimeConfig:
+    """Настройки потоков и привязки к ядрам для CPU-инференса."""
+
+    def __init__(self, inference_workers: int, intra_op_threads: int = 0, interop_threads: int = 1,
+                 cpus: Optional[List[int]] = None, pin_workers: bool = False):
+        self.cpus = sorted(cpus) if cpus else None
+        num_cpus = len(self.cpus) if self.cpus else len(available_cpus())
+        self.inference_workers = max(1, inference_workers)
+        self.intra_op_threads = intra_op_threads if intra_op_threads > 0 else max(1, num_cpus // self.inference_workers)
+        self.interop_threads = max(1, interop_threads)
+        self.pin_workers = pin_workers
+
+    @classmethod
+    def from_env(cls) -> "RuntimeConfig":
+        cpus = parse_cpu_list(INFERENCE_CPU_AFFINITY) if INFERENCE_CPU_AFFINITY else None
+        if INFERENCE_NUMA_NODE:
+            node_cpus = numa_node_cpus(int(INFERENCE_NUMA_NODE))
+            cpus = [cpu for cpu in cpus if cpu in node_cpus] if cpus else node_cpus
+        return cls(INFERENCE_WORKERS, TORCH_INTRA_OP_THREADS, TORCH_INTEROP_THREADS, cpus, PIN_INFERENCE_WORKERS)
+
+    def worker_cpus(self, worker_idx: int) -> List[int]:
+        """Непересекающийся набор из intra_op_threads ядер для потока инференса с номером worker_idx."""
+        cpus = self.cpus or available_cpus()
+        start = (worker_idx * self.intra_op_threads) % len(cpus)
+        return [cpus[(start + i) % len(cpus)] for i in range(min(self.intra_op_threads, len(cpus)))]
+
+    def as_env(self) -> dict:
+        """Переменные окружения, воспроизводящие эту конфигурацию."""
+        env = {
+            'INFERENCE_WORKERS': str(self.inference_workers),
+            'TORCH_INTRA_OP_THREADS': str(self.intra_op_threads),
+            'TORCH_INTEROP_THREADS': str(self.interop_threads),
+            'PIN_INFERENCE_WORKERS': str(self.pin_workers),
+        }
+        if self.cpus:
+            env['INFERENCE_CPU_AFFINITY'] = ",".join(str(cpu) for cpu in self.cpus)
+        return env
+
+    def __repr__(self):
+        cpus = f"{len(self.cpus)} ядер" if self.cpus else "все ядра"
+        return (f"RuntimeConfig(workers={self.inference_workers}, intra_op={self.intra_op_threads}, "
+                f"interop={self.interop_threads}, cpus={cpus}, pin_workers={self.pin_workers})")
+
+
+def apply_runtime_config(config: RuntimeConfig):
+    """
+    Применяет настройки потоков. Вызывается до загрузки модели и до первого forward:
+    set_num_interop_threads работает только до старта inter-op пула.
+    """
+    # Дочерние процессы и библиотеки, читающие окружение позже, получают те же лимиты;
+    # явно заданные OMP_NUM_THREADS/MKL_NUM_THREADS не перезаписываются
+    for name in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS'):
+        os.environ.setdefault(name, str(config.intra_op_threads))
+    if config.cpus and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, config.cpus)
+    torch.set_num_threads(config.intra_op_threads) # Заодно выставляет лимиты OpenMP и MKL
+    try:
+        torch.set_num_interop_threads(config.interop_threads)
+    except RuntimeError as e:
+        logger.warning(f"Не удалось изменить число inter-op потоков (пул уже запущен): {e}")
+    logger.info(f"Применена конфигурация потоков: {config}")
+
+
+def create_inference_executor(config: RuntimeConfig, thread_name_prefix: str = 'inference') -> futures.ThreadPoolExecutor:
+    """
+    Общий пул инференса из config.inference_workers потоков. При pin_workers каждый поток при старте
+    закрепляется за своими ядрами, и OpenMP-потоки его forward наследуют эту привязку.
+    """
+    initializer = None
+    if config.pin_workers and hasattr(os, 'sched_setaffinity'):
+        next_worker_idx = iter(range(config.inference_workers))
+        lock = threading.Lock()
+
+        def initializer():
+            with lock:
+                worker_idx = next(next_worker_idx, 0)
+            os.sched_setaffinity(0, config.worker_cpus(worker_idx)) # В Linux 0 = текущий поток
+            torch.set_num_threads(config.intra_op_threads)
+    return futures.ThreadPoolExecutor(max_workers=config.inference_workers, thread_name_prefix=thread_name_prefix,
+                                      initializer=initializer)
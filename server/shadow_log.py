@@ -0,0 +1,69 @@
+import os
+import json
+import queue
+import time
+import threading
+import logging
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Теневая модель: имя из реестра моделей, чья голова считается на тех же признаках энкодера, что и боевая.
+# Ее score только пишутся в лог для офлайн-сравнения и никогда не попадают в ответ
+SHADOW_MODEL_NAME = os.getenv('SHADOW_MODEL_NAME', '')
+SHADOW_LOG_FILE = os.getenv('SHADOW_LOG_FILE', 'shadow_scores.jsonl')
+SHADOW_QUEUE_SIZE = int(os.getenv('SHADOW_QUEUE_SIZE', '10000')) # Записей в очереди; при переполнении новые отбрасываются
+
+
+class ShadowScoreLogger:
+    """
+    Пишет score боевой и теневой модели в JSON Lines в фоновом потоке.
+    Вызовы log_* не блокируются: запись кладется в ограниченную очередь, а при ее переполнении
+    отбрасывается (счетчик dropped), чтобы теневой режим не влиял на задержку ответа.
+    """
+
+    def __init__(self, path: str = SHADOW_LOG_FILE, max_queue_size: int = SHADOW_QUEUE_SIZE):
+        self.path = path
+        self.dropped = 0
+        self._queue: "queue.Queue[Optional[dict]]" = queue.Queue(maxsize=max_queue_size)
+        self._writer = threading.Thread(target=self._write_loop, name='shadow-score-writer', daemon=True)
+        self._writer.start()
+
+    def _put(self, record: dict):
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                logger.warning(f"Очередь теневых score переполнена, отброшено записей: {self.dropped}")
+
+    def log_request(self, request_id: str, bucket_name: str, object_key: str, etag: Optional[str]):
+        """Связывает request_id с анализируемым объектом (для сопоставления записей офлайн)."""
+        self._put({"type": "request", "ts": time.time(), "request_id": request_id,
+                   "bucket": bucket_name, "key": object_key, "etag": etag})
+
+    def log_batch(self, request_id: str, chunk_indices: List[int], production_model: str, production_scores: List[float],
+                  shadow_model: str, shadow_scores: List[float]):
+        self._put({"type": "scores", "ts": time.time(), "request_id": request_id, "chunks": chunk_indices,
+                   "production_model": production_model, "production_scores": production_scores,
+                   "shadow_model": shadow_model, "shadow_scores": shadow_scores})
+
+    def _write_loop(self):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            while True:
+                record = self._queue.get()
+                if record is None:
+                    break
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                if self._queue.empty():
+                    f.flush() # Сбрасываем на диск пачками, а не на каждую запись
+
+    def close(self, timeout: float = 5.0):
+        """Дописывает очередь и останавливает поток записи."""
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            logger.warning("Теневой режим: поток записи не успевает, часть очереди не будет записана.")
+        self._writer.join(timeout)
+        if self.dropped:
+            logger.warning(f"Теневой режим: отброшено записей из-за переполнения очереди: {self.dropped}")
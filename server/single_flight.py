@@ -0,0 +1,132 @@
+import os
+import asyncio
+import threading
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Склейка одновременных одинаковых запросов (тот же объект, ETag и модель) в одно вычисление
+SINGLE_FLIGHT_ENABLED = os.getenv('SINGLE_FLIGHT_ENABLED', 'True').lower() == 'true'
+
+
+def grpc_time_remaining(context) -> Optional[float]:
+    """
+    Остаток дедлайна запроса в секундах или None, если дедлайна нет. Синхронный gRPC без дедлайна
+    возвращает огромное число (~9.2e18), которое не принимают Event.wait и таймеры.
+    """
+    remaining = context.time_remaining()
+    if remaining is None or remaining > threading.TIMEOUT_MAX:
+        return None
+    return remaining
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """
+    Для потоков: первый вызов do() с ключом выполняет fn, остальные вызовы с тем же ключом,
+    пришедшие до его завершения, ждут и получают тот же результат (или то же исключение).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any], timeout: Optional[float] = None) -> Tuple[Any, bool]:
+        """
+        Возвращает (результат, shared): shared=True, если результат получен от чужого вычисления.
+        Ожидающий вызов бросает TimeoutError по истечении timeout; само вычисление при этом продолжается.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.followers += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                leader = True
+
+        if not leader:
+            if not call.done.wait(timeout):
+                raise TimeoutError(f"Истекло время ожидания общего вычисления {key}")
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+            if call.followers:
+                logger.info(f"Single-flight {key}: результат отдан еще {call.followers} запросам")
+        return call.result, False
+
+
+class AsyncSingleFlight:
+    """
+    Вариант SingleFlight для одного event loop (grpc.aio). Вычисление идет отдельной задачей,
+    поэтому отмена запроса-инициатора (клиент отключился) не обрывает его для остальных.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+
+    def _on_done(self, key: Hashable, task: asyncio.Task):
+        self._calls.pop(key, None)
+        if not task.cancelled():
+            task.exception() # Помечаем исключение полученным, даже если результата никто не дождался
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]], timeout: Optional[float] = None) -> Tuple[Any, bool]:
+        task = self._calls.get(key)
+        if task is not None:
+            # shield: таймаут или отмена ожидающего не отменяет общее вычисление
+            return await asyncio.wait_for(asyncio.shield(task), timeout), True
+
+        task = self._calls[key] = asyncio.ensure_future(fn())
+        task.add_done_callback(lambda done_task: self._on_done(key, done_task))
+        return await asyncio.shield(task), False
+
+
+class RecordingContext:
+    """
+    Обертка над контекстом gRPC: запоминает set_code/set_details общего вычисления,
+    чтобы повторить их в контекстах запросов, получивших тот же результат.
+    """
+
+    def __init__(self, context):
+        self._context = context
+        self.code = None
+        self.details = None
+        self.object_etag = None # ETag объекта, который скачало общее вычисление
+
+    def record_object_etag(self, etag):
+        self.object_etag = etag.strip('"') if etag else None
+
+    def set_code(self, code):
+        self.code = code
+        self._context.set_code(code)
+
+    def set_details(self, details):
+        self.details = details
+        self._context.set_details(details)
+
+    def replay(self, context):
+        if self.code is not None:
+            context.set_code(self.code)
+        if self.details is not None:
+            context.set_details(self.details)
+
+    def __getattr__(self, name):
+        return getattr(self._context, name)
@@ -0,0 +1,124 @@
+import io
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent import futures
+from typing import Callable, Dict, Iterable, List, Optional
+
+import torch
+import torchaudio
+
+from inference import decode_to_chunk_buffer, to_chunk_buffer, INFERENCE_BATCH_SIZE, SAMPLE_RATE, NUM_SAMPLES
+
+logger = logging.getLogger(__name__)
+
+# Размеры батчей, которые прогоняются через модель при старте (через запятую).
+# Рабочий INFERENCE_BATCH_SIZE добавляется всегда; 1 нужен для хвостовых неполных батчей.
+WARMUP_BATCH_SIZES = [int(x) for x in os.getenv('WARMUP_BATCH_SIZES', '1').split(',') if x.strip()] + [INFERENCE_BATCH_SIZE]
+WARMUP_ITERATIONS = int(os.getenv('WARMUP_ITERATIONS', '2')) # Прогонов на каждый размер батча
+WARMUP_ATTEMPTS = int(os.getenv('WARMUP_ATTEMPTS', '3')) # Попыток прогрева, прежде чем сервер откажется стартовать
+# Частоты дискретизации, для которых заранее строятся ресемплеры (типичные для загружаемых файлов)
+WARMUP_SOURCE_SAMPLE_RATES = [int(x) for x in os.getenv('WARMUP_SOURCE_SAMPLE_RATES', '48000,44100,22050,8000').split(',') if x.strip()]
+
+
+class PhaseTimer:
+    """Собирает длительности фаз старта в секундах, в порядке их выполнения."""
+
+    def __init__(self):
+        self.timings: Dict[str, float] = {}
+
+    @contextmanager
+    def measure(self, phase: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[phase] = time.perf_counter() - started
+            logger.info(f"Фаза старта '{phase}': {self.timings[phase]:.3f} с")
+
+    def log_summary(self):
+        total = sum(self.timings.values())
+        details = ", ".join(f"{phase}={seconds:.3f}s" for phase, seconds in self.timings.items())
+        logger.info(f"Старт завершен за {total:.3f} с: {details}")
+
+
+def _warmup_decode():
+    """Кодирует и декодирует короткий стерео WAV, чтобы прогреть torchaudio backend и ресемплер."""
+    source_sr = WARMUP_SOURCE_SAMPLE_RATES[0] if WARMUP_SOURCE_SAMPLE_RATES else SAMPLE_RATE
+    buffer = io.BytesIO()
+    torchaudio.save(buffer, torch.zeros(2, source_sr), source_sr, format="wav")
+    chunk_buffer, _, errors = decode_to_chunk_buffer(buffer.getvalue())
+    if chunk_buffer is None:
+        logger.warning(f"Прогрев декодера не удался: {errors}")
+
+
+def _warmup_resamplers():
+    """Строит и один раз применяет ресемплеры для типичных частот (кэшируются в get_resampler)."""
+    for sr in WARMUP_SOURCE_SAMPLE_RATES:
+        to_chunk_buffer(torch.zeros(2, sr), sr)
+
+
+def _warmup_model(predict_batch: Callable[[torch.Tensor], torch.Tensor], device: torch.device, batch_size: int,
+                  inference_executor: Optional[futures.ThreadPoolExecutor] = None):
+    """
+    Прогоняет нулевые батчи [batch_size, NUM_SAMPLES] через тот же путь, что и боевые запросы:
+    в каждом потоке пула инференса (там своя привязка к ядрам и свой пул OpenMP). Без пула - в текущем потоке.
+    """
+    dummy = torch.zeros(batch_size, NUM_SAMPLES)
+
+    def _warmup_iterations():
+        for _ in range(WARMUP_ITERATIONS):
+            predict_batch(dummy)
+
+    if inference_executor is None:
+        _warmup_iterations()
+    else:
+        # Барьер не дает одному потоку забрать несколько задач: каждый поток пула делает свои прогоны
+        barrier = threading.Barrier(inference_executor._max_workers)
+
+        def _warmup_worker():
+            barrier.wait(10)
+            _warmup_iterations()
+
+        tasks = [inference_executor.submit(_warmup_worker) for _ in range(inference_executor._max_workers)]
+        for task in tasks:
+            task.result()
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+def prime_executor(executor: futures.ThreadPoolExecutor, num_workers: int):
+    """Заставляет пул поднять все потоки заранее: задачи ждут друг друга на барьере."""
+    barrier = threading.Barrier(num_workers)
+    tasks = [executor.submit(barrier.wait, 10) for _ in range(num_workers)]
+    futures.wait(tasks)
+
+
+def run_warmup(predict_batch: Callable[[torch.Tensor], torch.Tensor], device: torch.device, timer: PhaseTimer,
+               batch_sizes: Iterable[int] = None, executors: List[futures.ThreadPoolExecutor] = (),
+               inference_executor: Optional[futures.ThreadPoolExecutor] = None) -> bool:
+    """
+    Прогревает горячий путь: декодирование, ресемплинг, forward модели на каждом размере батча
+    (в каждом потоке inference_executor, если он передан) и (опционально) остальные пулы потоков.
+    Потоки inference_executor на время прогрева должны быть свободны от боевых задач.
+    Возвращает True, если прогрев прошел полностью; ошибки логируются.
+    """
+    batch_sizes = sorted(set(batch_sizes or WARMUP_BATCH_SIZES))
+    try:
+        with timer.measure("warmup_decode"):
+            _warmup_decode()
+        with timer.measure("warmup_resample"):
+            _warmup_resamplers()
+        for batch_size in batch_sizes:
+            with timer.measure(f"warmup_model_bs{batch_size}"):
+                _warmup_model(predict_batch, device, batch_size, inference_executor)
+        if executors:
+            with timer.measure("warmup_executors"):
+                for executor in executors:
+                    prime_executor(executor, executor._max_workers)
+    except Exception as e:
+        logger.error(f"Ошибка во время прогрева: {e}", exc_info=True)
+        return False
+    return True